@@ -0,0 +1,137 @@
+import os
+import queue
+import multiprocessing
+import numpy as np
+from scipy import stats
+from tqdm.auto import tqdm
+from mesa.batchrunner import _make_model_kwargs
+from run_cache import RunCache
+from sweep import derive_seed, run_model, run_columns, run_rows, limited_threads
+
+## Adaptive replication: instead of a fixed number of iterations for every parameter point, keep running
+## iterations of a point until the confidence intervals of chosen reporters are narrow enough, or a cap is hit.
+##   * iteration i of a point gets the same derived seed as in sweep(), so its rows are the same as there;
+##   * a point is judged on its first n finished iterations, for n = min_iterations, min_iterations + 1, ...,
+##     and stops at the first n that meets every target. Iterations that finish out of order wait for the
+##     ones before them, so the iterations kept do not depend on how the runs were scheduled;
+##   * free workers always go to the unsettled point with the fewest iterations started.
+
+## Width of the t-based confidence interval of the mean of values (infinite for fewer than two values)
+def ci_width(values, confidence):
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return np.inf
+    return 2 * stats.t.ppf((1 + confidence) / 2, len(values) - 1) * values.std(ddof=1) / np.sqrt(len(values))
+
+## Run a sweep with as many iterations per parameter point as its targets need, and return the rows of the
+## kept runs like sweep(), numbered in batch_run's order (by iteration, then parameter point).
+##   targets: reporter -> widest acceptable confidence interval of its value at the end of a run,
+##            e.g. {"Accumulated_Gain": 2000, "Horizontal Final Average": 0.2}
+##   confidence: level of the confidence intervals
+##   min_iterations / max_iterations: iterations every point gets at least / at most
+## The remaining options are those of iter_sweep (no journal: use a cache to resume).
+def adaptive_sweep(model_cls, parameters, targets, confidence=0.95, min_iterations=3, max_iterations=50,
+                   max_steps=1000, data_collection_period=-1, processes=None, seed=0, cache=None,
+                   display_progress=True, threads_per_process=1, collection=None):
+    if max_iterations < 1 or min_iterations > max_iterations:
+        raise ValueError(f"Need 1 <= min_iterations <= max_iterations, got {min_iterations} and {max_iterations}")
+    ## A confidence interval needs two values, unless a point may only get one
+    min_iterations = min(max(min_iterations, 2), max_iterations)
+    points = list(_make_model_kwargs(parameters))
+    if isinstance(cache, (str, os.PathLike)):
+        cache = RunCache(cache)
+    started = [0] * len(points)
+    ## Finished runs of each point: iteration -> columns
+    finished = [{} for _ in points]
+    ## Number of iterations kept for each settled point, None while it still needs samples
+    kept = [None] * len(points)
+    cache_keys = {}
+    results = queue.SimpleQueue()
+    processes = processes or os.cpu_count() or 1
+    pool = None
+
+    ## Start the next iteration of point. Returns its result right away if it was in the cache or is run in
+    ## this process, or None once it is handed to the pool.
+    def launch(point):
+        nonlocal pool
+        iteration = started[point]
+        started[point] += 1
+        kwargs = dict(points[point])
+        if "seed" not in kwargs:
+            kwargs["seed"] = derive_seed(seed, model_cls, points[point], iteration)
+        run_id = point * max_iterations + iteration
+        if cache is not None:
+            cached_kwargs = kwargs if collection is None else {**kwargs, "collection": collection}
+            cache_keys[run_id] = cache.key(model_cls, cached_kwargs, max_steps, data_collection_period)
+            records = cache.get(cache_keys[run_id])
+            if records is not None:
+                return run_id, run_columns(run_id, iteration, kwargs, records), None
+        task = (model_cls, run_id, iteration, kwargs, max_steps, data_collection_period, collection)
+        if processes == 1:
+            return (*run_model(task), task)
+        ## The pool is only started once a run is not in the cache
+        if pool is None:
+            with limited_threads(threads_per_process):
+                pool = multiprocessing.Pool(processes)
+        pool.apply_async(run_model, (task,), callback=lambda result: results.put((*result, task)),
+                         error_callback=results.put)
+        return None
+
+    ## Settle point once the first n of its iterations meet every target, or max_iterations have finished
+    def judge(point):
+        runs = finished[point]
+        n = min_iterations
+        while kept[point] is None and all(i in runs for i in range(n)):
+            finals = {name: [runs[i][name][-1] for i in range(n)] for name in targets}
+            if n >= max_iterations or all(ci_width(finals[name], confidence) <= width
+                                          for name, width in targets.items()):
+                kept[point] = n
+            n += 1
+        return kept[point] is not None
+
+    def finish(result, progress):
+        run_id, columns, task = result
+        point, iteration = divmod(run_id, max_iterations)
+        if cache is not None and task is not None:
+            ## Keep only what the run computed, as iter_sweep does
+            cache.put(cache_keys[run_id], {name: values.tolist() for name, values in columns.items()
+                                           if name not in ("RunId", "iteration", *task[3])})
+        if kept[point] is None:
+            finished[point][iteration] = columns
+            if judge(point):
+                progress.update()
+
+    ## Start iterations of the unsettled point with the fewest iterations started, until every worker is busy
+    def fill(in_flight, progress):
+        while in_flight < processes:
+            waiting = [point for point in range(len(points)) if kept[point] is None and started[point] < max_iterations]
+            if not waiting:
+                break
+            result = launch(min(waiting, key=lambda point: started[point]))
+            if result is None:
+                in_flight += 1
+            else:
+                finish(result, progress)
+        return in_flight
+
+    with tqdm(total=len(points), disable=not display_progress, unit="point") as progress:
+        try:
+            in_flight = fill(0, progress)
+            while in_flight:
+                result = results.get()
+                in_flight -= 1
+                if isinstance(result, BaseException):
+                    raise result
+                finish(result, progress)
+                in_flight = fill(in_flight, progress)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+    ## Number the kept runs as batch_run would: all points' first iteration, then their second, ...
+    order = sorted((iteration, point) for point in range(len(points)) for iteration in range(kept[point]))
+    rows = []
+    for run_id, (iteration, point) in enumerate(order):
+        columns = finished[point][iteration]
+        rows.extend(run_rows({**columns, "RunId": np.full(len(columns["Step"]), run_id)}))
+    return rows
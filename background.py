@@ -0,0 +1,154 @@
+import time
+import asyncio
+import threading
+import solara
+from mesa.visualization.solara_viz import ComponentsView, ModelCreator
+from mesa.visualization.utils import force_update, update_counter
+
+class BackgroundRunner:
+    ## Steps a model in a worker thread while the page shows it. The worker and the page take turns through
+    ## one condition: the page asks for a frame, the worker finishes the step it is in and waits, the page
+    ## draws the model as it is and lets the worker go on. So a frame never sees a half-done step, and a
+    ## slow step or a slow drawing only delays the other, never freezes the page.
+    def __init__(self, model):
+        self.model = model
+        self.condition = threading.Condition()
+        self.frame_wanted = False
+        self.stopping = False
+        self.thread = None
+        ## Exception that stopped the worker, shown on the page
+        self.error = None
+        ## Steps and time at the last frame, for the steps per second shown on the page
+        self.last_frame = (time.perf_counter(), model.steps)
+        self.steps_per_second = 0.0
+
+    @property
+    def playing(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def work(self):
+        try:
+            while True:
+                with self.condition:
+                    while self.frame_wanted and not self.stopping:
+                        self.condition.wait()
+                    if self.stopping or not self.model.running:
+                        return
+                    self.model.step()
+        except Exception as error:
+            self.error = error
+
+    def play(self):
+        if self.playing or not self.model.running:
+            return
+        self.stopping = False
+        self.error = None
+        self.last_frame = (time.perf_counter(), self.model.steps)
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    ## Stop the worker after the step it is in, and wait for it
+    def pause(self):
+        if self.thread is None:
+            return
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.thread = None
+
+    ## Run draw with the worker held between two steps
+    def frame(self, draw):
+        self.frame_wanted = True
+        with self.condition:
+            try:
+                now, steps = time.perf_counter(), self.model.steps
+                last_time, last_steps = self.last_frame
+                self.steps_per_second = (steps - last_steps) / (now - last_time) if now > last_time else 0.0
+                self.last_frame = (now, steps)
+                draw()
+            finally:
+                self.frame_wanted = False
+                self.condition.notify_all()
+
+## Play / pause / step / reset controls for a BackgroundRunner. While playing, the page is redrawn
+## frame_rate times a second with whatever step the model has reached.
+@solara.component
+def BackgroundController(model, runner, model_parameters, frame_rate):
+    playing = solara.use_reactive(False)
+    running = solara.use_reactive(model.value.running)
+
+    async def sample():
+        while playing.value:
+            await asyncio.sleep(1 / frame_rate.value)
+            ## Checked before the frame, so the frame shows the step the worker stopped at
+            finished = not runner.playing
+            runner.frame(force_update)
+            if finished:
+                running.value = model.value.running
+                playing.value = False
+
+    solara.lab.use_task(sample, dependencies=[playing.value], prefer_threaded=False)
+
+    def do_play_pause():
+        if playing.value:
+            runner.pause()
+            force_update()
+        else:
+            runner.play()
+        playing.value = runner.playing
+
+    def do_step():
+        model.value.step()
+        running.value = model.value.running
+        force_update()
+
+    ## New parameters only take effect here, and the old model's worker is stopped before it is replaced
+    def do_reset():
+        runner.pause()
+        playing.value = False
+        model.value = model.value.__class__(**model_parameters.value)
+        runner.model = model.value
+        runner.error = None
+        running.value = model.value.running
+        force_update()
+
+    with solara.Row(justify="space-between"):
+        solara.Button(label="Reset", color="primary", on_click=do_reset)
+        solara.Button(label="▶" if not playing.value else "❚❚", color="primary", on_click=do_play_pause,
+                      disabled=not running.value)
+        solara.Button(label="Step", color="primary", on_click=do_step, disabled=playing.value or not running.value)
+
+@solara.component
+def ShowProgress(model, runner):
+    update_counter.get()
+    solara.Text(f"Step: {model.steps}")
+    if runner.playing:
+        solara.Text(f"Steps per second: {runner.steps_per_second:.1f}")
+    if runner.error is not None:
+        solara.Error(f"Stopped by {runner.error!r}")
+
+## Drop-in for SolaraViz (same model, components, model_params and name) that steps the model in a
+## BackgroundRunner, so the model runs as fast as it can and the page samples it at frame_rate frames a second
+@solara.component
+def BackgroundViz(model, components, model_params=None, name=None, frame_rate=10):
+    if not isinstance(model, solara.Reactive):
+        model = solara.use_reactive(model)  # noqa: SH102
+    runner = solara.use_memo(lambda: BackgroundRunner(model.value), dependencies=[])
+    model_parameters = solara.use_reactive({})
+    frame_rate = solara.use_reactive(frame_rate)
+    ## Stop the worker when the page goes away
+    solara.use_effect(lambda: runner.pause, [])
+
+    with solara.AppBar():
+        solara.AppBarTitle(name if name else model.value.__class__.__name__)
+    with solara.Sidebar(), solara.Column():
+        with solara.Card("Controls"):
+            solara.SliderInt(label="Frames per second", value=frame_rate, min=1, max=30)
+            BackgroundController(model, runner, model_parameters, frame_rate)
+        with solara.Card("Model Parameters"):
+            ModelCreator(model, model_params or {}, model_parameters=model_parameters)
+        with solara.Card("Information"):
+            ShowProgress(model.value, runner)
+
+    ComponentsView(components, model.value)
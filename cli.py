@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+from datetime import datetime, timezone
+
+## Headless command-line entry point for the models, and a benchmark suite:
+##   python cli.py run schelling --steps 200 --set engine=numpy --set radius=2 --out run.csv
+##   python cli.py bench --suite quick --out bench.json
+##   python cli.py compare before.json after.json
+## model_hw2 is not included: its model does not run (it uses mesa.time, which mesa 3 removed, and its
+## agents' strategies are never initialized).
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+## Model name -> (project folder, model class)
+MODELS = {
+    "schelling": ("schelling", "SchellingModel"),
+    "final": ("final", "StrategyModel"),
+}
+
+## Benchmark cases: (model, parameters). "quick" takes about a minute, "full" goes up to 1000x1000 grids.
+SUITES = {
+    "quick": [
+        *[("schelling", {"width": size, "height": size, "engine": "mesa", "radius": radius, "density": 0.8})
+          for size in (20, 50) for radius in (1, 2)],
+        *[("schelling", {"width": size, "height": size, "engine": "numpy", "radius": radius, "density": density})
+          for size in (20, 100, 300) for radius in (1, 3) for density in (0.5, 0.9)],
+        *[("final", {"width": size, "height": size, "update": update})
+          for size in (20, 50) for update in ("sequential", "synchronous")],
+    ],
+    "full": [
+        *[("schelling", {"width": size, "height": size, "engine": "mesa", "radius": radius, "density": density,
+                         "neighborhood": "incremental", "relocation": "indexed"})
+          for size in (20, 100, 300) for radius in (1, 3) for density in (0.5, 0.9)],
+        *[("schelling", {"width": size, "height": size, "engine": "numpy", "radius": radius, "density": density})
+          for size in (20, 100, 300, 1000) for radius in (1, 3, 5) for density in (0.5, 0.9)],
+        *[("final", {"width": size, "height": size, "update": "sequential"}) for size in (20, 100, 300)],
+        *[("final", {"width": size, "height": size, "update": "synchronous"}) for size in (20, 100, 300, 1000)],
+    ],
+}
+
+def load_model(name):
+    folder, class_name = MODELS[name]
+    sys.path.insert(0, os.path.join(ROOT, folder))
+    module = __import__("model")
+    return getattr(module, class_name)
+
+## Parse --set name=value, reading value as JSON where it is one (numbers, true/false, null), else as a string
+def parse_settings(settings):
+    parameters = {}
+    for setting in settings or []:
+        name, _, value = setting.partition("=")
+        try:
+            parameters[name] = json.loads(value)
+        except json.JSONDecodeError:
+            parameters[name] = value
+    return parameters
+
+## Peak resident memory of this process so far, in MiB (ru_maxrss is in KiB on Linux, bytes on macOS)
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+def num_agents(model):
+    return getattr(model, "num_agents", None) or len(model.agents)
+
+## Time one model: its construction, then up to steps steps, stopping early after budget seconds
+## or when the model stops running. Agent updates count every agent once per step.
+def measure(model_name, parameters, steps, budget):
+    model_cls = load_model(model_name)
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    model = model_cls(**parameters)
+    init_seconds = time.perf_counter() - start
+    agents = num_agents(model)
+    done = 0
+    start = time.perf_counter()
+    while done < steps and model.running:
+        model.step()
+        done += 1
+        if time.perf_counter() - start > budget:
+            break
+    seconds = time.perf_counter() - start
+    if hasattr(model, "close"):
+        model.close()
+    return {
+        "model": model_name,
+        "parameters": parameters,
+        "agents": agents,
+        "init_seconds": init_seconds,
+        "steps": done,
+        "seconds": seconds,
+        "steps_per_second": done / seconds if seconds else None,
+        "agent_updates_per_second": agents * done / seconds if seconds else None,
+        "rss_after_import_mb": rss_before,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+## Identifies a benchmark case across result files
+def case_key(result):
+    return json.dumps([result["model"], result["parameters"]], sort_keys=True)
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    import numpy, mesa
+    return {"commit": commit, "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "numpy": numpy.__version__, "mesa": mesa.__version__}
+
+def command_run(args):
+    model_cls = load_model(args.model)
+    parameters = parse_settings(args.set)
+    if args.seed is not None:
+        parameters["seed"] = args.seed
+    if args.profile:
+        parameters["profile"] = True
+    model = model_cls(**parameters)
+    start = time.perf_counter()
+    while model.running and model.steps < args.steps:
+        model.step()
+    seconds = time.perf_counter() - start
+    if hasattr(model, "close"):
+        model.close()
+    frame = model.datacollector.get_model_vars_dataframe()
+    ## Label the rows with the steps they were recorded at, which a collection policy may thin out
+    if hasattr(model, "collected_steps"):
+        frame.index = list(model.collected_steps)
+    frame.index.name = "Step"
+    print(f"{args.model}: {model.steps} steps in {seconds:.2f}s")
+    print(frame.tail(1).to_string())
+    if args.profile:
+        report = model.profiler.report()
+        for phase, seconds in sorted(report["seconds"].items(), key=lambda item: -item[1]):
+            print(f"  {phase:20} {seconds:9.3f}s  {report['calls'][phase]:9} calls")
+        for name, value in report["counters"].items():
+            print(f"  {name:20} {value:10}")
+    if args.out:
+        if args.out.endswith(".parquet"):
+            frame.to_parquet(args.out)
+        else:
+            frame.to_csv(args.out)
+
+## Each case runs in a fresh interpreter, so peak RSS belongs to that case alone and the projects'
+## same-named modules (model.py, agents.py) never meet
+def command_bench(args):
+    cases = [case for case in SUITES[args.suite] if args.models is None or case[0] in args.models]
+    results = []
+    for model_name, parameters in cases:
+        parameters = {**parameters, "seed": args.seed}
+        process = subprocess.run([sys.executable, __file__, "case", model_name, json.dumps(parameters),
+                                  "--steps", str(args.steps), "--budget", str(args.budget)],
+                                 capture_output=True, text=True)
+        if process.returncode != 0:
+            print(f"{model_name} {parameters} failed:\n{process.stderr}", file=sys.stderr)
+            continue
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{model_name:10} {json.dumps(result['parameters'], sort_keys=True)[:90]:90} "
+              f"init {result['init_seconds']:7.3f}s  {result['steps_per_second']:9.2f} steps/s  "
+              f"{result['agent_updates_per_second']:12.0f} updates/s  {result['peak_rss_mb']:7.1f} MiB")
+    report = {"environment": environment(), "suite": args.suite, "steps": args.steps, "budget": args.budget,
+              "results": results}
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump(report, file, indent=1)
+
+def command_case(args):
+    result = measure(args.model, json.loads(args.parameters), args.steps, args.budget)
+    print(json.dumps(result))
+
+## Compare two benchmark files case by case; exits with status 1 if any case got slower than threshold
+def command_compare(args):
+    with open(args.before) as file:
+        before = {case_key(result): result for result in json.load(file)["results"]}
+    with open(args.after) as file:
+        after = {case_key(result): result for result in json.load(file)["results"]}
+    regressions = 0
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        if not old["steps_per_second"] or not new["steps_per_second"]:
+            continue
+        speedup = new["steps_per_second"] / old["steps_per_second"]
+        memory = new["peak_rss_mb"] / old["peak_rss_mb"]
+        flag = "  SLOWER" if speedup < 1 - args.threshold else ""
+        regressions += bool(flag)
+        print(f"{key[:100]:100} x{speedup:6.2f} speed  x{memory:5.2f} memory{flag}")
+    for key in sorted(before.keys() ^ after.keys()):
+        print(f"{key[:100]:100} only in {'before' if key in before else 'after'}")
+    sys.exit(1 if regressions else 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the models headless and benchmark them")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run one model and print or save its reporters")
+    run.add_argument("model", choices=MODELS)
+    run.add_argument("--steps", type=int, default=100)
+    run.add_argument("--seed", type=int)
+    run.add_argument("--set", action="append", metavar="NAME=VALUE", help="model parameter, may be repeated")
+    run.add_argument("--out", help="write the reporters to this .csv or .parquet file")
+    run.add_argument("--profile", action="store_true", help="print the time spent in each phase of a step")
+    run.set_defaults(handler=command_run)
+    bench = commands.add_parser("bench", help="run the benchmark suite")
+    bench.add_argument("--suite", choices=SUITES, default="quick")
+    bench.add_argument("--models", nargs="+", choices=MODELS)
+    bench.add_argument("--steps", type=int, default=20, help="steps timed per case")
+    bench.add_argument("--budget", type=float, default=10.0, help="seconds after which a case stops stepping")
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--out", help="write the results to this JSON file")
+    bench.set_defaults(handler=command_bench)
+    case = commands.add_parser("case", help=argparse.SUPPRESS)
+    case.add_argument("model", choices=MODELS)
+    case.add_argument("parameters")
+    case.add_argument("--steps", type=int, default=20)
+    case.add_argument("--budget", type=float, default=10.0)
+    case.set_defaults(handler=command_case)
+    compare = commands.add_parser("compare", help="compare two benchmark result files")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    compare.add_argument("--threshold", type=float, default=0.1, help="slowdown reported as a regression")
+    compare.set_defaults(handler=command_compare)
+    args = parser.parse_args()
+    args.handler(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,89 @@
 import numpy as np
-import math
 from mesa.experimental.cell_space import CellAgent
+from strategy_store import LEARNER_TYPES
 
-## Helper function to get distance between two cells
-def get_distance(cell_1, cell_2):
-    x1, y1 = cell_1.coordinate
-    x2, y2 = cell_2.coordinate
-    dx = x1 - x2
-    dy = y1 - y2
-    return math.sqrt(dx**2 + dy**2)
+## Helper function to draw the initial strategies of n agents at once from a numpy Generator
+# The accuracy to key should be a normal distributuon. 
+# A few agents are highly accurate, e.g., 24/25, while most agents have mediocre strategy, e.g., 12/25. 
+def draw_strategies(key_matrix, n, rng):
+    accuracies = np.clip(rng.normal(loc=12.5, scale=3, size=n), 0, 25).astype(int)
+    # each agent gets a random set of `accuracy` correct digits: the ones ranked first by random keys
+    ranks = rng.random((n, 25)).argsort(axis=1).argsort(axis=1)
+    correct = ranks < accuracies[:, None]
+    # every other digit is one of the 9 digits that differ from the key, each equally likely
+    wrong_digits = (key_matrix + rng.integers(1, 10, size=(n, 25))) % 10
+    return np.where(correct, key_matrix, wrong_digits).astype(np.uint8)
 
 class StrategyAgent(CellAgent):
-    ## Initialize agent
-    def __init__(self, model, cell, learner_type=None):
+    ## The agent's own state lives in the store, so the only attribute it adds is its cell index.
+    ## Per-agent memory is not reduced beyond that: mesa's Agent base class gives every agent a __dict__
+    ## (for unique_id, model, cell and pos), so __slots__ here would save nothing.
+
+    ## Initialize agent. Its state lives in the model's StrategyStore, at the index of its cell.
+    ## A cohort's strategies are drawn together by the model and passed in; otherwise the agent draws its own.
+    def __init__(self, model, cell, learner_type=None, strategy=None):
         super().__init__(model)
         self.cell = cell
-        self.strategy = self.initialize_strategy()
+        self.index = model.store.index(cell.coordinate)
+        self.strategy = self.initialize_strategy() if strategy is None else strategy
         if learner_type is None:
-            self.learner_type = "horizontal" if self.random.random() < self.model.horizontal_ratio else "vertical"
-        else:
-            self.learner_type = learner_type
-        self.is_role_model = False
-        self.role_model_age = 0
-        self.gain = self.calculate_gain()
+            learner_type = "horizontal" if self.random.random() < self.model.horizontal_ratio else "vertical"
+        model.store.add(self.index, self.unique_id, learner_type)
+        ## The model computes the gains of a new cohort all at once, see StrategyModel.init_agents
 
-    # Generate initial strategy for each agent
-    # The accuracy to key should be a normal distributuon. 
-    # A few agents are highly accurate, e.g., 24/25, while most agents have mediocre strategy, e.g., 12/25. 
-    def initialize_strategy(self):
-        strategy = self.model.key_matrix.copy()
-        accuracy = int(np.clip(np.random.normal(loc=12.5, scale=3), 0, 25))
-        correct_indices = self.random.sample(range(25), accuracy)
-        for i in range(25):
-            if i not in correct_indices:
-                strategy[i] = self.random.choice([x for x in range(10) if x != self.model.key_matrix[i]])
-        return strategy
+    ## Views into the store
+    @property
+    def strategy(self):
+        return self.model.store.strategies[self.index]
+
+    @strategy.setter
+    def strategy(self, strategy):
+        self.model.store.strategies[self.index] = strategy
+
+    @property
+    def gain(self):
+        return int(self.model.store.gains[self.index])
+
+    @gain.setter
+    def gain(self, gain):
+        self.model.store.set_gain(self.index, gain)
+
+    @property
+    def learner_type(self):
+        return LEARNER_TYPES[self.model.store.learner_types[self.index]]
+
+    @learner_type.setter
+    def learner_type(self, learner_type):
+        self.model.store.set_learner_type(self.index, learner_type)
 
+    @property
+    def is_role_model(self):
+        return bool(self.model.store.is_role_model[self.index])
+
+    @is_role_model.setter
+    def is_role_model(self, is_role_model):
+        self.model.store.set_role_model(self.index, is_role_model)
+
+    @property
+    def role_model_age(self):
+        return int(self.model.store.role_model_age[self.index])
+
+    @role_model_age.setter
+    def role_model_age(self, age):
+        self.model.store.role_model_age[self.index] = age
+
+    ## Free the agent's cell in the store as well as in the grid
+    def remove(self):
+        self.model.store.remove(self.index)
+        super().remove()
+
+    # Generate initial strategy for each agent, see draw_strategies
+    def initialize_strategy(self):
+        return draw_strategies(self.model.key_matrix, 1, self.model.rng)[0]
 
     # Comparing the agent's strategy to the key, and calculate its gain. 1 point for 1 correct digit. 
     def calculate_gain(self):
-        return sum(1 for s, k in zip(self.strategy, self.model.key_matrix) if s == k)
+        return int(np.count_nonzero(self.strategy == self.model.key_matrix))
 
     def step(self):
         if self.is_role_model:
@@ -52,46 +96,48 @@ class StrategyAgent(CellAgent):
         self.gain = self.calculate_gain()
 
 # define horizontal and vertical learning
+# Other agents are referred to by the index of their cell in the store
     def horizontal_learn(self):
-        # look for all peer neighbors
-        peer_neighbors = [a for a in self.cell.neighborhood.agents if not a.is_role_model and a != self]
-        # If there are peer neighbors, find the most successful peer neighbor
-        if peer_neighbors:
-            best_peer = max(peer_neighbors, key=lambda a: a.gain)
-        # If there aren't peer neighbors, find the closest peer neighbor in the grid  
-        else: 
-            all_peers = [a for a in self.model.agents if not a.is_role_model and a != self]
-            # make a list of their cell
+        store = self.model.store
+        # look for all peer neighbors, and if there are any, find the most successful one
+        best_peer = store.best_neighbor(self.index, role_models=False)
+        # If there aren't peer neighbors, find the closest peer neighbor in the grid
         # If there are no peers in the grid, return
-            if not all_peers:
+        if best_peer is None:
+            profiler = self.model.profiler
+            profiler.count("horizontal_fallbacks")
+            with profiler.phase("nearest"):
+                best_peer = store.nearest(self.index, role_models=False)
+            if best_peer is None:
                 return
-            best_peer = min(all_peers, key=lambda a: get_distance(self.cell, a.cell))
         # If the agent is the most successful itself, don't learn. 
-        if best_peer.gain > self.gain:
+        if store.gains[best_peer] > store.gains[self.index]:
             self.adopt_strategy(best_peer)
 
     def vertical_learn(self):
-        # look for all senior neighbors ("role models")
-        role_model_neighbors = [a for a in self.cell.neighborhood.agents if a.is_role_model]
-        # If there are senior neighbors, find the most successful senior neighbor
-        if role_model_neighbors:
-            best_model = max(role_model_neighbors, key=lambda a: a.gain)
-        # If there aren't senior neighbors, find the closest senior neighbor in the grid  
-        else:
-            all_models = [a for a in self.model.agents if a.is_role_model]
+        store = self.model.store
+        # look for all senior neighbors ("role models"), and if there are any, find the most successful one
+        best_model = store.best_neighbor(self.index, role_models=True)
+        # If there aren't senior neighbors, find the closest senior neighbor in the grid
         # If there are no seniors in the grid, return
-            if not all_models:
-                return 
-            best_model = min(all_models, key=lambda a: get_distance(self.cell, a.cell))
+        if best_model is None:
+            profiler = self.model.profiler
+            profiler.count("vertical_fallbacks")
+            with profiler.phase("nearest"):
+                best_model = store.nearest(self.index, role_models=True)
+            if best_model is None:
+                return
         # If the agent is the most successful itself, don't learn. 
-        if best_model.gain > self.gain:
+        if store.gains[best_model] > store.gains[self.index]:
             self.adopt_strategy(best_model)
 
     # After deciding the object of social learning, agents blindly learn one digit from this object.
     # Note that they get to keep their original correct digits.
     def adopt_strategy(self, other):
-        error_indices = [i for i, (s, k) in enumerate(zip(self.strategy, self.model.key_matrix)) if s != k]
-        learnable_indices = [i for i in error_indices if self.strategy[i] != other.strategy[i]]
-        if learnable_indices:
-            idx = self.random.choice(learnable_indices)
-            self.strategy[idx] = other.strategy[idx]
+        strategy = self.strategy
+        other_strategy = self.model.store.strategies[other]
+        learnable_indices = np.flatnonzero((strategy != self.model.key_matrix) & (strategy != other_strategy))
+        if learnable_indices.size:
+            idx = self.random.choice(learnable_indices.tolist())
+            strategy[idx] = other_strategy[idx]
+            self.model.profiler.count("adoptions")
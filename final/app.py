@@ -1,29 +1,38 @@
+import os
+import sys
+import numpy as np
 from model import StrategyModel
+## Modules shared by the projects, such as raster.py and background.py, live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from raster import make_raster_component
+from background import BackgroundViz
 from mesa.visualization import (
     Slider,
     SolaraViz,
     make_plot_component,
-    make_space_component,
 )
+
 # Horizontal agents are red. Vertical agents are blue. Role models are black (inactive). 
 # The intensity of color reflects how much gain an agent has. The more intense, the higher gain.  
-def agent_portrayal(agent):
-    max_gain = 25
-    norm_gain = min(agent.gain / max_gain, 1.0)
-    alpha = 0.2 + 0.8 * norm_gain # give a base color degree of 20%, or we can't tell the agent type.
-
-    if agent.is_role_model:
-        color = (0, 0, 0, alpha)  # black
-    elif agent.learner_type == "horizontal":
-        color = (1, 0, 0, alpha)  # red
-    else:
-        color = (0, 0, 1, alpha)  # blue
-
-    return {
-        "color": color,
-        "marker": "s",
-        "size": 40,
-    }
+HORIZONTAL_COLOR = (1, 0, 0)  # red
+VERTICAL_COLOR = (0, 0, 1)  # blue
+ROLE_MODEL_COLOR = (0, 0, 0)  # black
+MAX_GAIN = 25
+
+# give a base color degree of 20%, or we can't tell the agent type.
+def gain_alpha(gain):
+    return 0.2 + 0.8 * np.minimum(gain / MAX_GAIN, 1.0)
+
+## The whole grid as one RGBA image (rows are y, columns are x) in the colors above,
+## built from the model's store in a single vectorized pass. Empty cells are transparent.
+def strategy_image(model):
+    store = model.store
+    colors = np.array([HORIZONTAL_COLOR, VERTICAL_COLOR], dtype=float)[store.learner_types]
+    colors[store.is_role_model] = ROLE_MODEL_COLOR
+    alpha = np.where(store.occupied, gain_alpha(store.gains), 0.0)
+    image = np.concatenate([colors, alpha[:, None]], axis=1)
+    return image.reshape(model.width, model.height, 4).transpose(1, 0, 2)
+
 # setting up default values. 
 model_params = {
     "seed": {
@@ -31,21 +40,30 @@ model_params = {
         "value": 42,
         "label": "Random Seed",
     },
-    "width": Slider("Grid Width", value=20, min=10, max=50, step=1),
-    "height": Slider("Grid Height", value=20, min=10, max=50, step=1),
+    "width": Slider("Grid Width", value=20, min=10, max=500, step=1),
+    "height": Slider("Grid Height", value=20, min=10, max=500, step=1),
     "key_change": Slider("Proportion of Key Change", value=0.8, min=0, max=1, step=0.01),
     "horizontal_ratio": Slider("Proportion of Horizontal Learners", value=0.5, min=0, max=1, step=0.01),
     "role_model_ratio": Slider("Proportion of Role Models", value=0.3, min=0, max=1, step=0.01),
+    "update": {
+        "type": "Select",
+        "value": "sequential",
+        "values": ["sequential", "synchronous"],
+        "label": "Update",
+    },
 }
 
 # Setting up facets that enable visualization. 
-SpaceGraph = make_space_component(agent_portrayal=agent_portrayal)
+SpaceGraph = make_raster_component(strategy_image)
 GainPlot = make_plot_component(["Horizontal_Avg_Gain", "Vertical_Avg_Gain"])
 AccumulatedPlot = make_plot_component("Accumulated_Gain")
 
 strategy_model = StrategyModel()
 
-page = SolaraViz(
+# Step the model in a background thread and redraw at a fixed frame rate; False steps and draws in turn, as SolaraViz does.
+BACKGROUND_STEPPING = True
+
+page = (BackgroundViz if BACKGROUND_STEPPING else SolaraViz)(
     model=strategy_model,
     components=[SpaceGraph, GainPlot, AccumulatedPlot],
     model_params=model_params,
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+class RunningStats:
+    ## Count, mean and variance of a stream of values, updated in O(1) per value (Welford's algorithm),
+    ## so a reporter over the whole history of a run costs the same at every step.
+    ## Values may also be arrays, e.g. one value per replica of an ensemble.
+    def __init__(self):
+        self.count = 0
+        self.mean = np.nan
+        self.m2 = 0.0
+
+    def push(self, value):
+        self.count += 1
+        if self.count == 1:
+            self.mean = np.array(value, dtype=float) if np.ndim(value) else float(value)
+            self.m2 = self.mean * 0.0
+            return
+        delta = value - self.mean
+        self.mean = self.mean + delta / self.count
+        self.m2 = self.m2 + delta * (value - self.mean)
+
+    ## Population variance of the values pushed so far, like np.var (nan before the first value)
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+class ColumnarCollector:
+    ## Stand-in for mesa.DataCollector with model reporters only. Every reporter writes into its own
+    ## preallocated NumPy column, so collecting a step is one store per reporter and no row dicts are built.
+    ## Columns start with room for capacity steps and double when full; reserve() sizes them up front
+    ## (e.g. from max_steps). model_vars and the exports are views of the columns, not copies.
+    ## The model's step at each collection is kept too, and labels the rows of the DataFrame.
+    def __init__(self, model_reporters, capacity=128):
+        self.model_reporters = dict(model_reporters)
+        self.capacity = capacity
+        self.length = 0
+        ## Created on the first collect, with the dtype of the first value of each reporter
+        self.columns = {}
+        self.step_column = np.empty(capacity, dtype=np.int64)
+        ## Read by mesa's batch_run, which also looks for agent records
+        self.agent_reporters = {}
+        self._agent_records = {}
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        self.capacity = capacity
+        steps = np.empty(capacity, dtype=np.int64)
+        steps[:self.length] = self.step_column[:self.length]
+        self.step_column = steps
+        for name, column in self.columns.items():
+            resized = np.empty(capacity, dtype=column.dtype)
+            resized[:self.length] = column[:self.length]
+            self.columns[name] = resized
+
+    def collect(self, model):
+        if self.length == self.capacity:
+            self.reserve(2 * self.capacity)
+        for name, reporter in self.model_reporters.items():
+            value = reporter(model)
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = np.empty(self.capacity, dtype=np.asarray(value).dtype)
+            elif column.dtype.kind in "iub" and isinstance(value, (float, np.floating)):
+                # an integer reporter that turns out to give fractions
+                column = self.columns[name] = column.astype(float)
+            column[self.length] = value
+        self.step_column[self.length] = model.steps
+        self.length += 1
+
+    ## Forget everything collected so far, keeping the columns' memory
+    def clear(self):
+        self.length = 0
+
+    ## Collected values of every reporter, one view per column, indexed by collection
+    @property
+    def model_vars(self):
+        return {name: column[:self.length] for name, column in self.columns.items()}
+
+    ## Step of the model at each collection
+    @property
+    def steps(self):
+        return self.step_column[:self.length]
+
+    ## Selected collections (e.g. the steps batch_run keeps) of every reporter
+    def take(self, indices):
+        return {name: column[:self.length][indices] for name, column in self.columns.items()}
+
+    def get_model_vars_dataframe(self):
+        return pd.DataFrame(self.model_vars, index=pd.Index(self.steps, name="Step"), copy=False)
+
+    ## The columns as a pyarrow Table (numeric columns are wrapped, not copied)
+    def to_arrow(self):
+        import pyarrow as pa
+        return pa.table(self.model_vars)
@@ -0,0 +1,229 @@
+import random
+import numpy as np
+from mesa.batchrunner import _make_model_kwargs
+from mesa.experimental.cell_space import OrthogonalMooreGrid
+from agents import draw_strategies
+from strategy_store import StrategyStore, LEARNER_TYPES
+from collector import RunningStats
+
+## Model parameters an ensemble can vary from replica to replica
+REPLICA_PARAMETERS = ("seed", "key_change", "horizontal_ratio", "role_model_ratio")
+
+class StrategyEnsemble:
+    ## Many replicas of StrategyModel(update="synchronous") on the same grid size, advanced together.
+    ## Their state is stacked into replicas x cells (x 25) arrays, so a round is a handful of array
+    ## operations for all replicas at once. Each replica keeps its own random generators, seeded the
+    ## way mesa seeds a model and used in the same order, so a replica gives the same results as a
+    ## standalone StrategyModel(update="synchronous") with the same parameters and seed.
+    def __init__(self, runs, width=20, height=20):
+        self.width = width
+        self.height = height
+        num_replicas = len(runs)
+        ## Cell coordinates and Moore neighbors, taken from a grid like the model's
+        geometry = StrategyStore(OrthogonalMooreGrid((width, height), torus=True, random=random.Random()), width, height)
+        self.coordinates = geometry.coordinates
+        self.neighbors = geometry.neighbors
+        num_cells = width * height
+        ## Cells within a distance of sqrt(15) of each cell, and their squared distances. Every cell that close
+        ## is included, so an agent found there is the nearest one. (Only on grids where the offsets don't wrap.)
+        self.ring_cells = None
+        if width >= 7 and height >= 7:
+            offsets = np.array([(dx, dy) for dx in range(-3, 4) for dy in range(-3, 4) if 0 < dx * dx + dy * dy <= 15])
+            self.ring_distances = (offsets ** 2).sum(axis=1)
+            x, y = self.coordinates[:, 0, None], self.coordinates[:, 1, None]
+            self.ring_cells = (x + offsets[:, 0]) % width * height + (y + offsets[:, 1]) % height
+        for run in runs:
+            unknown = set(run) - set(REPLICA_PARAMETERS)
+            if unknown:
+                raise ValueError(f"Parameters {sorted(unknown)} cannot vary within an ensemble")
+        self.randoms = [random.Random(run.get("seed")) for run in runs]
+        self.rngs = [np.random.default_rng(run.get("seed")) for run in runs]
+        self.key_change = np.array([run.get("key_change", 0.8) for run in runs])
+        self.horizontal_ratio = np.array([run.get("horizontal_ratio", 0.5) for run in runs])
+        self.role_model_ratio = np.array([run.get("role_model_ratio", 0.3) for run in runs])
+        self.strategies = np.zeros((num_replicas, num_cells, 25), dtype=np.uint8)
+        self.gains = np.zeros((num_replicas, num_cells), dtype=np.int64)
+        self.learner_types = np.zeros((num_replicas, num_cells), dtype=np.int8)
+        self.is_role_model = np.zeros((num_replicas, num_cells), dtype=bool)
+        self.occupied = np.zeros((num_replicas, num_cells), dtype=bool)
+        ## Creation order of the agents, standing in for unique_id when breaking ties
+        self.ids = np.zeros((num_replicas, num_cells), dtype=np.int64)
+        self.next_id = 1
+        self.steps = 0
+        self.generation = 0
+        self.round = 0
+        self.accumulated_gain = np.zeros(num_replicas, dtype=np.int64)
+        self.horizontal_gains = RunningStats()
+        self.vertical_gains = RunningStats()
+        ## One row of reporter values per replica for every collected step
+        self.model_vars = []
+        self.keys = np.array([rand.choices(range(10), k=25) for rand in self.randoms], dtype=np.uint8)
+        self.init_agents()
+        self.init_agents()
+        self.collect()
+
+    ## Replace every agent that is not a role model with a new cohort, as StrategyModel.init_agents does
+    def init_agents(self):
+        self.occupied &= self.is_role_model
+        for replica in range(len(self.randoms)):
+            cells = np.flatnonzero(~self.occupied[replica]).tolist()
+            self.randoms[replica].shuffle(cells)
+            cells = np.array(cells, dtype=int)
+            num_horizontal = int(len(cells) * self.horizontal_ratio[replica])
+            self.strategies[replica, cells] = draw_strategies(self.keys[replica], len(cells), self.rngs[replica])
+            self.learner_types[replica, cells] = np.arange(len(cells)) >= num_horizontal
+            self.occupied[replica, cells] = True
+            self.ids[replica, cells] = self.next_id + np.arange(len(cells))
+            self.next_id += len(cells)
+        peers = self.peers()
+        self.gains[peers] = (self.strategies == self.keys[:, None, :]).sum(axis=2)[peers]
+
+    def peers(self):
+        return self.occupied & ~self.is_role_model
+
+    ## Each replica's key changes in int(key_change * 25) digits, as in StrategyModel.mutate_key_matrix
+    def mutate_keys(self):
+        for replica, (rand, rng) in enumerate(zip(self.randoms, self.rngs)):
+            num_changes = int(self.key_change[replica] * 25)
+            indices = np.array(rand.sample(range(25), num_changes), dtype=int)
+            self.keys[replica, indices] = (self.keys[replica, indices] + rng.integers(1, 10, size=num_changes)) % 10
+
+    ## For every (replica, cell) pair, the nearest agent across the torus among the role models
+    ## (role_models[i] True) or the peers, ties going to the oldest; -1 where there is none
+    def nearest(self, replicas, cells, role_models):
+        nearest = np.full(len(cells), -1)
+        search = np.arange(len(cells))
+        if self.ring_cells is not None and len(cells):
+            ring = self.ring_cells[cells]
+            candidates = (self.occupied[replicas[:, None], ring]
+                          & (self.is_role_model[replicas[:, None], ring] == role_models[:, None]))
+            order = np.where(candidates, self.ring_distances * self.next_id + self.ids[replicas[:, None], ring],
+                             np.iinfo(np.int64).max)
+            found = candidates.any(axis=1)
+            nearest[found] = ring[found, order[found].argmin(axis=1)]
+            search = np.flatnonzero(~found)
+        ## Search the whole grid for the rest, skipping replicas that have no such agent at all
+        anywhere = (self.occupied & self.is_role_model).any(axis=1), (self.occupied & ~self.is_role_model).any(axis=1)
+        search = search[np.where(role_models[search], anywhere[0][replicas[search]], anywhere[1][replicas[search]])]
+        if len(search) == 0:
+            return nearest
+        replicas, cells, role_models = replicas[search], cells[search], role_models[search]
+        candidates = self.occupied[replicas] & (self.is_role_model[replicas] == role_models[:, None])
+        candidates[np.arange(len(cells)), cells] = False
+        offsets = np.abs(self.coordinates[cells][:, None, :] - self.coordinates[None, :, :])
+        offsets = np.minimum(offsets, np.array([self.width, self.height]) - offsets)
+        distances = (offsets ** 2).sum(axis=2)
+        order = np.where(candidates, distances * self.next_id + self.ids[replicas], np.iinfo(np.int64).max)
+        nearest[search] = np.where(candidates.any(axis=1), order.argmin(axis=1), -1)
+        return nearest
+
+    ## One synchronous round for every replica, following StrategyModel.step_synchronous
+    def learn(self):
+        replicas, learners = np.nonzero(self.peers())
+        strategies = self.strategies.copy()
+        role_models = self.learner_types[replicas, learners] == LEARNER_TYPES.index("vertical")
+        neighbors = self.neighbors[learners]
+        valid = (self.occupied[replicas[:, None], neighbors]
+                 & (self.is_role_model[replicas[:, None], neighbors] == role_models[:, None])
+                 & (neighbors != learners[:, None]))
+        gains = np.where(valid, self.gains[replicas[:, None], neighbors], -1)
+        teachers = np.where(valid.any(axis=1), neighbors[np.arange(len(learners)), gains.argmax(axis=1)], -1)
+        alone = np.flatnonzero(teachers < 0)
+        teachers[alone] = self.nearest(replicas[alone], learners[alone], role_models[alone])
+        learning = teachers >= 0
+        learning[learning] = self.gains[replicas[learning], teachers[learning]] > self.gains[replicas[learning], learners[learning]]
+        replicas, learners, teachers = replicas[learning], learners[learning], teachers[learning]
+        own = strategies[replicas, learners]
+        learnable = (own != self.keys[replicas]) & (own != strategies[replicas, teachers])
+        ## Each replica draws the random numbers for its own learners, in cell order
+        counts = np.bincount(replicas, minlength=len(self.rngs))
+        draws = np.concatenate([rng.random((count, 25)) for rng, count in zip(self.rngs, counts)])
+        picks = np.where(learnable, draws, -1).argmax(axis=1)
+        copying = learnable.any(axis=1)
+        replicas, learners, teachers, picks = replicas[copying], learners[copying], teachers[copying], picks[copying]
+        self.strategies[replicas, learners, picks] = strategies[replicas, teachers, picks]
+        self.gains[replicas, learners] = (self.strategies[replicas, learners] == self.keys[replicas]).sum(axis=1)
+
+    ## Keep the top role_model_ratio of each replica's learners by gain, ties to the oldest, and remove everyone else
+    def select_role_models(self):
+        self.occupied &= ~self.is_role_model
+        self.is_role_model[:] = False
+        for replica in range(len(self.rngs)):
+            candidates = np.flatnonzero(self.occupied[replica])
+            ranked = candidates[np.lexsort((self.ids[replica, candidates], -self.gains[replica, candidates]))]
+            num_keep = int(len(candidates) * self.role_model_ratio[replica])
+            self.is_role_model[replica, ranked[:num_keep]] = True
+        self.occupied &= self.is_role_model
+
+    ## Average gain of the active learners of one type in every replica (0 where there are none)
+    def average_gain(self, learner_type):
+        learners = self.peers() & (self.learner_types == LEARNER_TYPES.index(learner_type))
+        counts = learners.sum(axis=1)
+        totals = np.where(learners, self.gains, 0).sum(axis=1)
+        return np.divide(totals, counts, out=np.zeros(len(counts)), where=counts > 0)
+
+    def total_gain(self):
+        return np.where(self.peers(), self.gains, 0).sum(axis=1)
+
+    ## Record the same reporters as StrategyModel's DataCollector, for every replica
+    def collect(self):
+        ## Running mean of each replica's round averages, as the model's reporters keep it
+        horizontal_final = np.broadcast_to(self.horizontal_gains.mean, len(self.rngs))
+        vertical_final = np.broadcast_to(self.vertical_gains.mean, len(self.rngs))
+        columns = {
+            "Horizontal_Avg_Gain": self.average_gain("horizontal"),
+            "Vertical_Avg_Gain": self.average_gain("vertical"),
+            "Total_Gain": self.total_gain(),
+            "Accumulated_Gain": self.accumulated_gain.copy(),
+            "Horizontal Final Average": horizontal_final,
+            "Vertical Final Average": vertical_final,
+        }
+        self.model_vars.append([{name: values[r].item() if hasattr(values[r], "item") else values[r]
+                                 for name, values in columns.items()} for r in range(len(self.rngs))])
+
+    def step(self):
+        self.steps += 1
+        if self.round == 0:
+            self.mutate_keys()
+            self.generation += 1
+            self.init_agents()
+        self.learn()
+        self.horizontal_gains.push(self.average_gain("horizontal"))
+        self.vertical_gains.push(self.average_gain("vertical"))
+        self.round = (self.round + 1) % 5
+        if self.round == 0:
+            self.accumulated_gain += self.total_gain()
+            self.collect()
+            self.select_role_models()
+        else:
+            self.collect()
+
+## Run a parameter sweep like mesa's batch_run, but with all runs on one grid size advanced together as an
+## ensemble. Runs use update="synchronous". Returns rows in batch_run's layout
+## (RunId, iteration, Step, parameters, reporters), so pd.DataFrame(results) works the same way.
+def ensemble_run(parameters, iterations=1, data_collection_period=-1, max_steps=1000):
+    runs = []
+    for iteration in range(iterations):
+        for kwargs in _make_model_kwargs(parameters):
+            if kwargs.get("update", "synchronous") != "synchronous":
+                raise ValueError("Ensembles only run update=\"synchronous\"")
+            runs.append((len(runs), iteration, kwargs))
+    ## One ensemble per grid size
+    groups = {}
+    for run in runs:
+        kwargs = run[2]
+        groups.setdefault((kwargs.get("width", 20), kwargs.get("height", 20)), []).append(run)
+    rows = {}
+    for (width, height), group in groups.items():
+        replica_runs = [{k: v for k, v in kwargs.items() if k in REPLICA_PARAMETERS} for _, _, kwargs in group]
+        ensemble = StrategyEnsemble(replica_runs, width, height)
+        ## Same stopping rule and collected steps as batch_run
+        while ensemble.steps <= max_steps:
+            ensemble.step()
+        steps = list(range(0, ensemble.steps, data_collection_period))
+        if not steps or steps[-1] != ensemble.steps - 1:
+            steps.append(ensemble.steps - 1)
+        for replica, (run_id, iteration, kwargs) in enumerate(group):
+            rows[run_id] = [{"RunId": run_id, "iteration": iteration, "Step": step, **kwargs,
+                             **ensemble.model_vars[step][replica]} for step in steps]
+    return [row for run_id in sorted(rows) for row in rows[run_id]]
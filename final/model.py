@@ -1,18 +1,51 @@
+import os
+import sys
 import numpy as np
 import mesa
-from agents import StrategyAgent
+from agents import StrategyAgent, draw_strategies
+from strategy_store import StrategyStore, LEARNER_TYPES
+from collector import ColumnarCollector, RunningStats
+## Modules shared by the projects, such as profiling.py, live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from profiling import PhaseProfiler
 from mesa.experimental.cell_space import OrthogonalMooreGrid
 
+## Phases of a step and event counters recorded by the model's profiler
+PROFILE_PHASES = ("init_agents", "learn", "nearest", "select_role_models", "collect")
+PROFILE_COUNTERS = ("horizontal_fallbacks", "vertical_fallbacks", "adoptions")
+
 class StrategyModel(mesa.Model): 
     # Initializing model
     # The grid size is 20 by 20. The key changes 80% by each generation (a volatile socieity).
     # There are 50% horizontal learners. 30% of senior agents get to be kept as role models to the next generation. 
-    def __init__(self, width=20, height=20, seed=None, key_change=0.8, horizontal_ratio=0.5, role_model_ratio=0.3):
+    ## update: "sequential" lets agents learn one after another, each seeing the changes made before it in the round;
+    ## "synchronous" lets all learners learn at once from the strategies and gains of the previous round
+    ## collection: when the datacollector records the reporters. "step" after every step, a number k every k steps,
+    ## "generation" at the end of every generation, "final" only the latest step (earlier records are dropped).
+    ## The initial state is always recorded first, and so is the last step once close() is called at the end
+    ## of a run. collected_steps lists the step of every record, which also labels the rows of
+    ## datacollector.get_model_vars_dataframe().
+    ## profile: True records the wall time and calls of each phase of a step (PROFILE_PHASES) and counts
+    ## nearest-agent fallbacks and adopted digits in model.profiler; "collect" also adds them to the
+    ## datacollector, per collection
+    def __init__(self, width=20, height=20, seed=None, key_change=0.8, horizontal_ratio=0.5, role_model_ratio=0.3,
+                 update="sequential", collection="step", profile=False):
         super().__init__(seed=seed)
+        if update not in ("sequential", "synchronous"):
+            raise ValueError(f"Unknown update {update!r}, must be 'sequential' or 'synchronous'")
+        if collection not in ("step", "generation", "final") and not (
+                isinstance(collection, (int, np.integer)) and collection > 0):
+            raise ValueError(f"Unknown collection {collection!r}, must be 'step', 'generation', 'final' "
+                             "or a number of steps")
+        self.update = update
+        self.collection = collection
+        self.profiler = PhaseProfiler(enabled=bool(profile))
         self.width = width
         self.height = height
         ## Initialize grid
         self.grid = OrthogonalMooreGrid((width, height), torus=True, random=self.random)
+        ## Strategies, gains, learner types and role-model flags of all agents, as arrays indexed by cell
+        self.store = StrategyStore(self.grid, width, height)
         self.running = True # for batch run
         self.generation = 0
         self.round = 0
@@ -20,41 +53,42 @@ class StrategyModel(mesa.Model):
         self.horizontal_ratio = horizontal_ratio
         self.role_model_ratio = role_model_ratio
         self.key_matrix = self.generate_key_matrix()
-        ## Set up datacollector, collects the average gain of different agents
-        self.datacollector = mesa.DataCollector(
+        ## Set up datacollector, collects the average gain of different agents into preallocated columns
+        self.datacollector = ColumnarCollector(
             model_reporters=
             {
                 "Horizontal_Avg_Gain": lambda m: m.average_gain("horizontal"),
                 "Vertical_Avg_Gain": lambda m: m.average_gain("vertical"),
                 "Total_Gain": lambda m: m.total_gain(),
                 "Accumulated_Gain": lambda m: m.accumulated_gain,
-                "Horizontal Final Average": lambda m: np.mean(m.horizontal_gains),
-                "Vertical Final Average": lambda m: np.mean(m.vertical_gains)
+                "Horizontal Final Average": lambda m: m.horizontal_gains.mean,
+                "Vertical Final Average": lambda m: m.vertical_gains.mean,
+                **(self.profiler.reporters(PROFILE_PHASES, PROFILE_COUNTERS) if profile == "collect" else {})
             }
         )
 
         self.role_models = []
-
         #This record every round's "Horizontal/Vertical_Avg_Gain"
-        self.horizontal_gains = []
-        self.vertical_gains = []
+        ## as a running mean and variance, instead of keeping every value
+        self.horizontal_gains = RunningStats()
+        self.vertical_gains = RunningStats()
 
         self.accumulated_gain = 0
         self.init_first_generation()
         self.init_agents()
-        self.datacollector.collect(self)
+        self.collect()
         
     # generate the key strategy of the first generation
     def generate_key_matrix(self):
-        return self.random.choices(range(10), k=25)
+        return np.array(self.random.choices(range(10), k=25), dtype=np.uint8)
     
     # mutate the key strategy based on the proportion of key change for succeeding generations
+    # Each changed digit becomes one of the 9 other digits, each equally likely
     def mutate_key_matrix(self):
         new_key = self.key_matrix.copy()
         num_changes = int(self.key_change * 25)
-        indices = self.random.sample(range(25), num_changes)
-        for idx in indices:
-            new_key[idx] = self.random.choice([i for i in range(10) if i != new_key[idx]])
+        indices = np.array(self.random.sample(range(25), num_changes), dtype=int)
+        new_key[indices] = (new_key[indices] + self.rng.integers(1, 10, size=num_changes)) % 10
         return new_key
     
     # Initialize new agents in a new generation. 
@@ -62,11 +96,7 @@ class StrategyModel(mesa.Model):
     def init_first_generation(self):
         empty_cells = [cell for cell in self.grid.all_cells.cells if not cell.agents]
         self.random.shuffle(empty_cells)
-        num_horizontal = int(len(empty_cells) * self.horizontal_ratio)
-
-        for i, cell in enumerate(empty_cells):
-            learner_type = "horizontal" if i < num_horizontal else "vertical"
-            StrategyAgent.create_agents(self, 1, cell=cell, learner_type=learner_type)
+        self.create_cohort(empty_cells)
 
     def init_agents(self):
         for agent in list(self.agents):
@@ -76,25 +106,39 @@ class StrategyModel(mesa.Model):
         # get all empty cells after cleaning up the non-role models
         empty_cells = [cell for cell in self.grid.all_cells.cells if not cell.agents]
         self.random.shuffle(empty_cells)
-        num_horizontal = int(len(empty_cells) * self.horizontal_ratio)
-
-        # fill in new agents
-        for i, cell in enumerate(empty_cells):
-            learner_type = "horizontal" if i < num_horizontal else "vertical"
-            StrategyAgent.create_agents(self, 1, cell=cell, learner_type=learner_type)
+        self.create_cohort(empty_cells)
+
+    # Fill the given cells with new agents, the first horizontal_ratio of them horizontal learners.
+    # The strategies of the whole cohort are drawn in one call to the model's seeded generator.
+    def create_cohort(self, cells):
+        num_horizontal = int(len(cells) * self.horizontal_ratio)
+        learner_types = ["horizontal" if i < num_horizontal else "vertical" for i in range(len(cells))]
+        strategies = draw_strategies(self.key_matrix, len(cells), self.rng)
+        StrategyAgent.create_agents(self, len(cells), cell=cells, learner_type=learner_types, strategy=strategies)
+        # compute the gains of the new generation against the current key in one pass
+        # (role models keep the gain they earned in their own generation)
+        self.store.calculate_gains(self.store.peers(), self.key_matrix)
+        # index the peers and role models of this generation for the nearest-agent fallback
+        self.store.build_indexes()
 
     # Initialize a new generation. Change the key to the current generation. 
     def step(self):
+        profiler = self.profiler
         if self.round == 0:
-            self.key_matrix = self.mutate_key_matrix()
-            self.generation += 1
-            self.init_agents() 
+            with profiler.phase("init_agents"):
+                self.key_matrix = self.mutate_key_matrix()
+                self.generation += 1
+                self.init_agents() 
 
-        self.agents.do("step")
+        with profiler.phase("learn"):
+            if self.update == "synchronous":
+                self.step_synchronous()
+            else:
+                self.agents.do("step")
 
         # Record this round's "Horizontal/Vertical_Avg_Gain"
-        self.horizontal_gains.append(self.average_gain("horizontal"))
-        self.vertical_gains.append(self.average_gain("vertical"))
+        self.horizontal_gains.push(self.average_gain("horizontal"))
+        self.vertical_gains.push(self.average_gain("vertical"))
 
         self.round = (self.round + 1) % 5
         
@@ -102,10 +146,73 @@ class StrategyModel(mesa.Model):
         if self.round == 0:  
             generation_gain = self.total_gain()
             self.accumulated_gain += generation_gain
-            self.datacollector.collect(self)
-            self.select_role_models() # keep role models and delete others
+            self.collect()
+            with profiler.phase("select_role_models"):
+                self.select_role_models() # keep role models and delete others
+        else:
+            self.collect()
+
+    # Step of every record of the datacollector
+    @property
+    def collected_steps(self):
+        return self.datacollector.steps
+
+    # Record the reporters if the collection policy asks for this step, or always
+    def collect(self, always=False):
+        if self.collection == "generation":
+            due = self.round == 0
+        elif self.collection in ("step", "final"):
+            due = True
         else:
+            due = self.steps % self.collection == 0
+        if not (due or always):
+            return
+        if self.collection == "final":
+            self.datacollector.clear()
+        with self.profiler.phase("collect"):
             self.datacollector.collect(self)
+            # before the phase ends, so the time of this collection is reported by the next one
+            self.profiler.mark_collected()
+
+    # End a run: record its last step if the collection policy skipped it. Call this when you stop stepping.
+    def close(self):
+        if self.collected_steps[-1] != self.steps:
+            self.collect(always=True)
+
+    # One round of social learning for the whole population as array operations (update="synchronous").
+    # Every learner picks its teacher and the digit to copy from a frozen copy of the strategies and gains
+    # at the start of the round, then all the copies are made at once, so the order of agents does not matter.
+    # The rules are the same as in StrategyAgent.step.
+    def step_synchronous(self):
+        store = self.store
+        store.role_model_age[store.is_role_model] += 1
+        learners = np.flatnonzero(store.peers())
+        strategies = store.strategies.copy()
+        teachers = np.full(len(learners), -1)
+        for learner_type, role_models in (("horizontal", False), ("vertical", True)):
+            of_type = store.learner_types[learners] == LEARNER_TYPES.index(learner_type)
+            cells = learners[of_type]
+            chosen = store.best_neighbors(cells, role_models)
+            # fall back to the nearest peer or role model anywhere on the grid
+            fallbacks = np.flatnonzero(chosen < 0)
+            self.profiler.count(f"{learner_type}_fallbacks", len(fallbacks))
+            with self.profiler.phase("nearest"):
+                for i in fallbacks:
+                    nearest = store.nearest(cells[i], role_models)
+                    chosen[i] = -1 if nearest is None else nearest
+            teachers[of_type] = chosen
+        # only learn from someone more successful
+        learning = teachers >= 0
+        learning[learning] = store.gains[teachers[learning]] > store.gains[learners[learning]]
+        learners, teachers = learners[learning], teachers[learning]
+        # copy one digit, chosen at random, that the learner has wrong and the teacher has differently
+        learnable = (strategies[learners] != self.key_matrix) & (strategies[learners] != strategies[teachers])
+        picks = np.where(learnable, self.rng.random(learnable.shape), -1).argmax(axis=1)
+        copying = learnable.any(axis=1)
+        learners, teachers, picks = learners[copying], teachers[copying], picks[copying]
+        store.strategies[learners, picks] = strategies[teachers, picks]
+        store.calculate_gains(learners, self.key_matrix)
+        self.profiler.count("adoptions", len(learners))
 
     # Identify the most successful agents as role models and only keep them in the grid
     def select_role_models(self):
@@ -113,26 +220,22 @@ class StrategyModel(mesa.Model):
         for agent in self.role_models:
             agent.remove()
 
-        # find the role model of this generation
-        agents = [a for a in self.agents if not a.is_role_model]
-        agents.sort(key=lambda a: a.gain, reverse=True)
-        num_keep = int(len(agents) * self.role_model_ratio)
-        keep_agents = agents[:num_keep]
-        for agent in keep_agents:
-            agent.is_role_model = True
-        self.role_models = keep_agents
+        # find the role model of this generation: highest gain first, ties in the order of model.agents
+        store = self.store
+        candidates = np.flatnonzero(store.peers())
+        ranked = candidates[np.lexsort((store.ids[candidates], -store.gains[candidates].astype(int)))]
+        num_keep = int(len(candidates) * self.role_model_ratio)
+        store.set_role_model(ranked[:num_keep])
+        self.role_models = [a for a in self.agents if a.is_role_model]
 
         # delete all other agents
-        for agent in list(self.agents - set(keep_agents)):
+        for agent in [a for a in self.agents if not a.is_role_model]:
             agent.remove()
 
     # Calculate the average gain of all active vertical/horizontal learners. 
     def average_gain(self, learner_type):
-        agents = [a for a in self.agents if a.learner_type == learner_type and not a.is_role_model]
-        if agents:
-            return sum(a.gain for a in agents) / len(agents)
-        return 0
+        return self.store.average_gain(learner_type)
     
     # Calculate the gross gain of all active agents. 
     def total_gain(self):
-        return sum(a.gain for a in self.agents if not a.is_role_model)
+        return self.store.total_gain()
@@ -0,0 +1,154 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+## Learner types are stored as codes, in this order
+LEARNER_TYPES = ("horizontal", "vertical")
+## The possible gains, 0 to 25 matching digits
+GAIN_VALUES = np.arange(26)
+
+class StrategyStore:
+    ## Strategies, gains, learner types and role-model flags of the whole population, kept as arrays
+    ## indexed by cell (x * height + y). Agents are thin views into these arrays, so population-wide
+    ## work such as recomputing gains is one vectorized operation instead of a loop over agents.
+    def __init__(self, grid, width, height):
+        num_cells = width * height
+        self.width = width
+        self.height = height
+        self.strategies = np.zeros((num_cells, 25), dtype=np.uint8)
+        self.gains = np.zeros(num_cells, dtype=np.uint8)
+        self.learner_types = np.zeros(num_cells, dtype=np.int8)
+        self.is_role_model = np.zeros(num_cells, dtype=bool)
+        self.role_model_age = np.zeros(num_cells, dtype=np.int32)
+        self.occupied = np.zeros(num_cells, dtype=bool)
+        ## unique_id of the agent in each cell; model.agents iterates agents in this order
+        self.ids = np.zeros(num_cells, dtype=np.int64)
+        self.coordinates = np.zeros((num_cells, 2), dtype=np.int64)
+        ## Moore neighbors of each cell in the order of cell.neighborhood, padded with the cell itself
+        ## (only on grids narrower than 3 cells, where neighbors repeat)
+        self.neighbors = np.zeros((num_cells, 8), dtype=np.int64)
+        for cell in grid.all_cells:
+            index = self.index(cell.coordinate)
+            self.coordinates[index] = cell.coordinate
+            neighbors = list(dict.fromkeys(self.index(c.coordinate) for c in cell.connections.values()))
+            self.neighbors[index] = neighbors + [index] * (8 - len(neighbors))
+        ## Ledger of the population: number of agents by role model or not, learner type and gain.
+        ## Every change below keeps it up to date, so averages and totals never scan the population.
+        self.histogram = np.zeros((2, len(LEARNER_TYPES), 26), dtype=np.int64)
+        ## Spatial indexes over the role models and over the peers, keyed by role_models
+        self.trees = {True: (None, None), False: (None, None)}
+
+    def index(self, coordinate):
+        return coordinate[0] * self.height + coordinate[1]
+
+    ## Cells holding agents that still learn, i.e. not role models
+    def peers(self):
+        return self.occupied & ~self.is_role_model
+
+    ## Add (sign=1) or take away (sign=-1) the agents in the given cells from the ledger
+    def tally(self, cells, sign):
+        if np.ndim(cells) == 0:
+            self.histogram[int(self.is_role_model[cells]), self.learner_types[cells], self.gains[cells]] += sign
+        else:
+            np.add.at(self.histogram, (self.is_role_model[cells].astype(int), self.learner_types[cells], self.gains[cells]), sign)
+
+    ## Seat a new agent in cell, with no gain until it is computed
+    def add(self, cell, unique_id, learner_type):
+        self.occupied[cell] = True
+        self.ids[cell] = unique_id
+        self.learner_types[cell] = LEARNER_TYPES.index(learner_type)
+        self.is_role_model[cell] = False
+        self.role_model_age[cell] = 0
+        self.gains[cell] = 0
+        self.tally(cell, 1)
+
+    def remove(self, cell):
+        self.tally(cell, -1)
+        self.occupied[cell] = False
+        self.is_role_model[cell] = False
+
+    def set_gain(self, cell, gain):
+        self.tally(cell, -1)
+        self.gains[cell] = gain
+        self.tally(cell, 1)
+
+    def set_learner_type(self, cell, learner_type):
+        self.tally(cell, -1)
+        self.learner_types[cell] = LEARNER_TYPES.index(learner_type)
+        self.tally(cell, 1)
+
+    ## Make the agents in the given cells role models, or take the role away (is_role_model=False)
+    def set_role_model(self, cells, is_role_model=True):
+        self.tally(cells, -1)
+        self.is_role_model[cells] = is_role_model
+        self.tally(cells, 1)
+
+    ## Recompute the gain of the agents in the given cells: 1 point for each digit that matches the key
+    def calculate_gains(self, cells, key_matrix):
+        cells = np.flatnonzero(cells) if cells.dtype == bool else cells
+        self.tally(cells, -1)
+        self.gains[cells] = (self.strategies[cells] == key_matrix).sum(axis=1)
+        self.tally(cells, 1)
+
+    ## Which of the given cells hold role models (role_models=True) or peers (role_models=False)
+    def holds(self, cells, role_models):
+        return self.occupied[cells] & (self.is_role_model[cells] == role_models)
+
+    ## The neighbor of cell with the highest gain among the role models or the peers, or None.
+    ## Ties go to the first neighbor in neighborhood order, as max() over the neighborhood would.
+    def best_neighbor(self, cell, role_models):
+        neighbors = self.neighbors[cell]
+        candidates = neighbors[self.holds(neighbors, role_models) & (neighbors != cell)]
+        if candidates.size == 0:
+            return None
+        return int(candidates[np.argmax(self.gains[candidates])])
+
+    ## best_neighbor for many cells at once: an array with the chosen neighbor of each cell, -1 where there is none
+    def best_neighbors(self, cells, role_models):
+        neighbors = self.neighbors[cells]
+        valid = self.holds(neighbors, role_models) & (neighbors != cells[:, None])
+        gains = np.where(valid, self.gains[neighbors].astype(int), -1)
+        best = neighbors[np.arange(len(cells)), gains.argmax(axis=1)]
+        return np.where(valid.any(axis=1), best, -1)
+
+    ## Build a KD-tree over the cells of the role models and one over the peers. Coordinates wrap
+    ## around at width and height, like the torus of the grid. Call this whenever either set changes.
+    def build_indexes(self):
+        for role_models in (True, False):
+            cells = np.flatnonzero(self.holds(slice(None), role_models))
+            tree = cKDTree(self.coordinates[cells], boxsize=(self.width, self.height)) if cells.size else None
+            self.trees[role_models] = (cells, tree)
+
+    ## The role model or peer closest to cell (distance across the torus), or None, in O(log N).
+    ## Ties go to the oldest agent, as min() over model.agents would.
+    def nearest(self, cell, role_models):
+        cells, tree = self.trees[role_models]
+        if tree is None:
+            return None
+        position = self.coordinates[cell]
+        # ask for two agents, in case the first one is the agent itself
+        distances, found = tree.query(position, k=min(2, cells.size))
+        distances, found = np.atleast_1d(distances), np.atleast_1d(found)
+        others = cells[found] != cell
+        if not others.any():
+            return None
+        # gather everyone at the nearest distance (squared distances are whole numbers)
+        ties = cells[tree.query_ball_point(position, distances[others][0] + 1e-6)]
+        ties = ties[ties != cell]
+        return int(ties[np.argmin(self.ids[ties])])
+
+    ## Number of agents with each gain (0..25) of one learner type, among the active (non role model)
+    ## learners or among the role models
+    def gain_histogram(self, learner_type, role_models=False):
+        return self.histogram[int(role_models), LEARNER_TYPES.index(learner_type)]
+
+    ## Average gain of the active (non role model) learners of one type
+    def average_gain(self, learner_type, role_models=False):
+        histogram = self.gain_histogram(learner_type, role_models)
+        count = histogram.sum()
+        if count:
+            return float(histogram @ GAIN_VALUES / count)
+        return 0
+
+    ## Gross gain of the active agents
+    def total_gain(self):
+        return int(self.histogram[0].sum(axis=0) @ GAIN_VALUES)
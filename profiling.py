@@ -0,0 +1,63 @@
+import time
+from contextlib import nullcontext
+
+## Shared by every disabled profiler, so an instrumented phase costs one call when profiling is off
+NO_PHASE = nullcontext()
+
+class Phase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.profiler.seconds[self.name] = self.profiler.seconds.get(self.name, 0.0) + time.perf_counter() - self.start
+        self.profiler.calls[self.name] = self.profiler.calls.get(self.name, 0) + 1
+
+class PhaseProfiler:
+    ## Wall time and number of calls of the named phases of a model's step, and counters of events
+    ## such as fallbacks or moves. Off unless enabled. Phases may be nested; a phase's time includes
+    ## the phases inside it.
+    ##     with model.profiler.phase("learn"): ...
+    ##     model.profiler.count("moves")
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+        ## Totals at the last collection, for per-collection reporters
+        self.collected = {}
+
+    def phase(self, name):
+        return Phase(self, name) if self.enabled else NO_PHASE
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        self.seconds.clear()
+        self.calls.clear()
+        self.counters.clear()
+        self.collected.clear()
+
+    ## Totals so far: {"seconds": {phase: s}, "calls": {phase: n}, "counters": {name: n}}
+    def report(self):
+        return {"seconds": dict(self.seconds), "calls": dict(self.calls), "counters": dict(self.counters)}
+
+    ## Time spent in a phase, or the value of a counter, since the last call to mark_collected
+    def since_collected(self, name):
+        total = self.counters.get(name, self.seconds.get(name, 0))
+        return total - self.collected.get(name, 0)
+
+    def mark_collected(self):
+        self.collected = {**self.seconds, **self.counters}
+
+    ## Reporters for a data collector: the seconds of each phase and the value of each counter
+    ## since the previous collection
+    def reporters(self, phases, counters):
+        reporters = {f"{name} seconds": lambda m, name=name: m.profiler.since_collected(name) for name in phases}
+        reporters.update({name: lambda m, name=name: m.profiler.since_collected(name) for name in counters})
+        return reporters
@@ -0,0 +1,29 @@
+import solara
+from matplotlib.figure import Figure
+from mesa.visualization.utils import update_counter
+
+## Space component for SolaraViz that draws a model's grid as one image instead of one marker per agent,
+## so large grids stay fast. image(model) returns the grid with rows along y: RGBA colors, or values that
+## imshow_options (e.g. cmap, vmin, vmax) map to colors. The image is only redrawn every N steps, with N
+## set by a slider on the component, so the model can step faster than it is drawn.
+def make_raster_component(image, **imshow_options):
+    @solara.component
+    def RasterSpace(model):
+        update_counter.get()
+        render_every = solara.use_reactive(1)
+        frame = model.steps // render_every.value
+
+        def draw():
+            fig = Figure()
+            ax = fig.add_subplot()
+            ax.imshow(image(model), origin="lower", interpolation="nearest", **imshow_options)
+            ax.set_axis_off()
+            return fig
+
+        figure = solara.use_memo(draw, dependencies=[model, frame])
+        with solara.Column() as space:
+            solara.SliderInt("Draw every N steps", value=render_every, min=1, max=100)
+            solara.FigureMatplotlib(figure, dependencies=[model, frame], format="png", bbox_inches="tight")
+        return space
+
+    return RasterSpace
@@ -0,0 +1,109 @@
+import os
+import sys
+import json
+import inspect
+import hashlib
+
+## Layout of the stored runs (columns of Step and the reporters). It is part of every key, so entries
+## written in an older layout are never read back.
+FORMAT = 2
+
+## The full parameter set of a run: the given kwargs plus the defaults of every other model parameter,
+## so the same parameter point is recognized whichever parameters a sweep happens to vary
+def resolve_parameters(model_cls, kwargs):
+    arguments = inspect.signature(model_cls).bind_partial(**kwargs)
+    arguments.apply_defaults()
+    return {name: value for name, value in arguments.arguments.items() if name not in ("args", "kwargs")}
+
+## Hash of the source of the model's project: every .py file next to the module that defines the model
+def source_hash(model_cls):
+    folder = os.path.dirname(os.path.abspath(sys.modules[model_cls.__module__].__file__))
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(os.listdir(folder)):
+        if name.endswith(".py"):
+            digest.update(name.encode())
+            with open(os.path.join(folder, name), "rb") as file:
+                digest.update(file.read())
+    return digest.hexdigest()
+
+class RunCache:
+    ## Finished runs on disk, one JSON file per run, named by the hash of everything that determines the run:
+    ## model class, full parameters (including the seed), max_steps, data_collection_period and model source.
+    ## Once the files add up to more than max_bytes, the least recently used runs are deleted.
+    def __init__(self, path, max_bytes = 1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self.source_hashes = {}
+        ## file name -> (last use, size). Uses are counted by self.clock; entries found on disk are ordered
+        ## by their modification time, which is refreshed whenever a run is read.
+        self.entries = {}
+        found = []
+        for name in os.listdir(path):
+            if name.endswith(".json"):
+                stat = os.stat(os.path.join(path, name))
+                found.append((stat.st_mtime, name, stat.st_size))
+        for clock, (_, name, size) in enumerate(sorted(found)):
+            self.entries[name] = (clock, size)
+        self.clock = len(found)
+        self.size = sum(size for _, size in self.entries.values())
+        self.evict()
+
+    def key(self, model_cls, kwargs, max_steps, data_collection_period):
+        if model_cls not in self.source_hashes:
+            self.source_hashes[model_cls] = source_hash(model_cls)
+        parts = [model_cls.__module__, model_cls.__qualname__, resolve_parameters(model_cls, kwargs),
+                 max_steps, data_collection_period, self.source_hashes[model_cls], FORMAT]
+        text = json.dumps(parts, default=lambda value: value.item() if hasattr(value, "item") else str(value),
+                          sort_keys=True)
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    ## The stored columns of a run, or None if it is not in the cache
+    def get(self, key):
+        name = key + ".json"
+        if name not in self.entries:
+            return None
+        file_path = os.path.join(self.path, name)
+        try:
+            with open(file_path) as file:
+                records = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            self.forget(name)
+            return None
+        ## Mark as recently used
+        os.utime(file_path)
+        self.clock += 1
+        self.entries[name] = (self.clock, self.entries[name][1])
+        return records
+
+    def put(self, key, records):
+        name = key + ".json"
+        file_path = os.path.join(self.path, name)
+        ## Write to a temporary file first, so an interrupted write never leaves a broken entry
+        with open(file_path + ".tmp", "w") as file:
+            json.dump(records, file, default=lambda value: value.item() if hasattr(value, "item") else str(value))
+        os.replace(file_path + ".tmp", file_path)
+        if name in self.entries:
+            self.size -= self.entries[name][1]
+        size = os.path.getsize(file_path)
+        self.clock += 1
+        self.entries[name] = (self.clock, size)
+        self.size += size
+        self.evict()
+
+    def forget(self, name):
+        _, size = self.entries.pop(name)
+        self.size -= size
+        try:
+            os.remove(os.path.join(self.path, name))
+        except FileNotFoundError:
+            pass
+
+    ## Delete the least recently used runs until the cache fits in max_bytes
+    def evict(self):
+        if self.size <= self.max_bytes:
+            return
+        for name, _ in sorted(self.entries.items(), key=lambda entry: entry[1][0]):
+            if self.size <= self.max_bytes:
+                break
+            self.forget(name)
@@ -1,5 +1,4 @@
 from mesa import Agent
-import random # Modification: I imported random. 
 
 class SchellingAgent(Agent):
     ## Initiate agent instance, inherit model trait from parent class
@@ -7,25 +6,38 @@ class SchellingAgent(Agent):
         super().__init__(model)
         ## Set agent type
         self.type = agent_type
+        ## Whether the agent was happy the last time it was activated
+        self.is_happy = False
     ## Define basic decision rule
     def move(self):
-        ## Get list of neighbors within range of sight
-        neighbors = self.model.grid.get_neighbors(
-            self.pos, moore = True, radius = self.model.radius, include_center = False)
-        ## Count neighbors of same type as self
-        similar_neighbors = len([n for n in neighbors if n.type == self.type])
+        ## Read neighbor counts from the model if it keeps them, otherwise look at every neighbor
+        if self.model.counts is not None:
+            similar_neighbors, valid_neighbors = self.model.counts.neighbors(self.pos, self.type)
+        else:
+            ## Get list of neighbors within range of sight
+            neighbors = self.model.grid.get_neighbors(
+                self.pos, moore = True, radius = self.model.radius, include_center = False)
+            ## Count neighbors of same type as self
+            similar_neighbors = len([n for n in neighbors if n.type == self.type])
+            valid_neighbors = len(neighbors)
         ## If an agent has any neighbors (to avoid division by zero), calculate share of neighbors of same type
-        if (valid_neighbors := len(neighbors)) > 0:
+        if valid_neighbors > 0:
             share_alike = similar_neighbors / valid_neighbors
         else:
             share_alike = 0
         ## If unhappy with neighbors, move to random empty slot. Otherwise add one to model count of happy agents.
-        if share_alike < self.model.desired_share_alike:
+        self.is_happy = share_alike >= self.model.desired_share_alike
+        if not self.is_happy:
+            ## Under active-set scheduling, unhappy agents are activated again next step
+            if self.model.dirty is not None:
+                self.model.dirty[self] = None
             # Modification: The random number (larger or equal to 0, smaller than 1) represents the circumstances of the agent.
             # It is random, because various factors influence the individual's ability to move. 
             # This can include financial affordability, determination, job market competence, family structure, etc.  
             # When the circumstances are good enough (larger than the societal friction), the agent will be able to move. 
-            if random.random() > self.model.friction: 
-                self.model.grid.move_to_empty(self)
+            # The draw comes from the model's seeded generator, so runs are reproducible under a seed.
+            if self.random.random() > self.model.friction: 
+                with self.model.profiler.phase("relocate"):
+                    self.model.relocate(self)
         else: 
             self.model.happy +=1   
@@ -1,18 +1,20 @@
-import solara
+import os
+import sys
+from matplotlib.colors import ListedColormap
 from model import SchellingModel
+from array_engine import EMPTY
+from trajectory import SchellingReplay
+## Modules shared by the projects, such as raster.py and background.py, live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from raster import make_raster_component
+from background import BackgroundViz
 from mesa.visualization import (  
     SolaraViz,
-    make_space_component,
     make_plot_component,
 )
 
-## Define agent portrayal: color, shape, and size
-def agent_portrayal(agent):
-    return {
-        "color": "blue" if agent.type == 1 else "red",
-        "marker": "s",
-        "size": 40,
-    }
+## Colors of empty cells and of agents of type 0 and type 1, as values of the type grid from EMPTY to 1
+TYPE_COLORS = ListedColormap(["white", "red", "blue"])
 
 ## Enumerate variable parameters in model: seed, grid dimensions, population density, agent preferences, vision, and relative size of groups.
 model_params = {
@@ -26,7 +28,7 @@ model_params = {
         "value": 50,
         "label": "Width",
         "min": 5,
-        "max": 100,
+        "max": 1000,
         "step": 1,
     },
     "height": {
@@ -34,7 +36,7 @@ model_params = {
         "value": 50,
         "label": "Height",
         "min": 5,
-        "max": 100,
+        "max": 1000,
         "step": 1,
     },
     "density": {
@@ -78,21 +80,39 @@ model_params = {
         "max": 1,
         "step": 0.01,
     },
+    "engine": {
+        "type": "Select",
+        "value": "mesa",
+        "label": "Engine",
+        "values": ["mesa", "numpy"],
+    },
 }
 
+## Path of a trajectory file (see trajectory.py) to replay instead of running the model, e.g. "run.traj".
+## A replay's only parameter is its file, so Reset reloads it from the first step.
+REPLAY = None
+
 ## Instantiate model
-schelling_model = SchellingModel()
+if REPLAY is None:
+    schelling_model = SchellingModel()
+else:
+    schelling_model = SchellingReplay(REPLAY)
+    model_params = {"path": REPLAY}
 
 ## Define happiness over time plot
 HappyPlot = make_plot_component({"share_happy": "tab:green"})
 
-## Define space component
-SpaceGraph = make_space_component(agent_portrayal, draw_grid=False)
+## Draw the grid as a single image of the model's type grid, which every engine and trajectory replays provide
+Space = make_raster_component(lambda model: model.type_grid().T, cmap=TYPE_COLORS, vmin=EMPTY, vmax=1)
+
+## Step the model in a background thread and redraw at a fixed frame rate,
+## or set to False to step and draw in turn as SolaraViz does
+BACKGROUND_STEPPING = True
 
 ## Instantiate page inclusing all components
-page = SolaraViz(
+page = (BackgroundViz if BACKGROUND_STEPPING else SolaraViz)(
     schelling_model,
-    components=[SpaceGraph, HappyPlot],
+    components=[Space, HappyPlot],
     model_params=model_params,
     name="Schelling Segregation Model",
 )
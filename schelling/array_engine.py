@@ -0,0 +1,71 @@
+import numpy as np
+
+## Cell value for an empty cell; occupied cells hold the agent type (0 or 1)
+EMPTY = -1
+
+## Sum every cell's window of +/- radius along one axis of a torus.
+## If the window is wider than the axis, each cell is only counted once (as SingleGrid does).
+def window_sum(counts, radius, axis):
+    size = counts.shape[axis]
+    if 2 * radius + 1 >= size:
+        total = counts.sum(axis=axis, keepdims=True)
+        return np.repeat(total, size, axis=axis)
+    ## Wrap the borders around, then take differences of the running sum
+    padded = np.concatenate(
+        [counts.take(range(size - radius, size), axis=axis), counts, counts.take(range(radius), axis=axis)],
+        axis=axis)
+    running = np.cumsum(padded, axis=axis)
+    zeros = np.zeros_like(running.take([0], axis=axis))
+    running = np.concatenate([zeros, running], axis=axis)
+    upper = running.take(range(2 * radius + 1, size + 2 * radius + 1), axis=axis)
+    lower = running.take(range(size), axis=axis)
+    return upper - lower
+
+## Count, for every cell, the agents of one type in its Moore neighborhood (center excluded)
+def neighbor_counts(types, agent_type, radius):
+    occupied = (types == agent_type).astype(np.int32)
+    box = window_sum(window_sum(occupied, radius, 0), radius, 1)
+    return box - occupied
+
+class ArrayEngine:
+    ## Keep the whole grid as one integer array instead of agent objects
+    def __init__(self, model):
+        self.model = model
+        self.types = np.full((model.width, model.height), EMPTY, dtype=np.int8)
+        ## Agents are numbered from 1 in placement order, like the unique_ids of the mesa engine (0 = empty)
+        self.ids = np.zeros((model.width, model.height), dtype=np.uint32)
+        for unique_id, (pos, agent_type) in enumerate(model.initial_types(), start=1):
+            self.types[pos] = agent_type
+            self.ids[pos] = unique_id
+        self.num_agents = int((self.types != EMPTY).sum())
+
+    ## Check the happiness of all agents at once, then move the unhappy ones who overcome the friction.
+    ## Unlike the mesa engine, every agent judges its neighborhood as it was at the start of the step.
+    def step(self):
+        model = self.model
+        type_one = neighbor_counts(self.types, 1, model.radius)
+        type_zero = neighbor_counts(self.types, 0, model.radius)
+        same_type = np.where(self.types == 1, type_one, type_zero)
+        valid_neighbors = type_one + type_zero
+        share_alike = np.divide(same_type, valid_neighbors, out=np.zeros(self.types.shape),
+                                where=valid_neighbors > 0)
+        occupied = self.types != EMPTY
+        happy = occupied & (share_alike >= model.desired_share_alike)
+        model.happy = int(happy.sum())
+        ## Same friction rule as SchellingAgent.move: only agents with good enough circumstances move
+        unhappy = np.flatnonzero(occupied & ~happy)
+        movers = unhappy[model.rng.random(unhappy.size) > model.friction]
+        with model.profiler.phase("relocate"):
+            self.relocate(movers, np.flatnonzero(~occupied))
+
+    ## Movers go to distinct random empty cells in random order; cells vacated this step are not reused
+    def relocate(self, movers, empties):
+        model = self.model
+        movers = model.rng.permutation(movers)[:empties.size]
+        destinations = model.rng.choice(empties, size=movers.size, replace=False)
+        model.moves = movers.size
+        if model.recorder is not None:
+            model.recorder.record_moves(self.ids.reshape(-1)[movers], movers, destinations)
+        for cells, vacant in ((self.types.reshape(-1), EMPTY), (self.ids.reshape(-1), 0)):
+            cells[destinations] = cells[movers]
+            cells[movers] = vacant
@@ -0,0 +1,24 @@
+import pandas as pd
+from mesa.datacollection import DataCollector
+
+class StepDataCollector(DataCollector):
+    ## mesa's DataCollector that also keeps the model's step at each collection, and labels the rows of
+    ## get_model_vars_dataframe() with it, so records skipped by a collection policy leave no wrong labels
+    def __init__(self, model_reporters=None, agent_reporters=None, agenttype_reporters=None, tables=None):
+        super().__init__(model_reporters, agent_reporters, agenttype_reporters, tables)
+        self.steps = []
+
+    def collect(self, model):
+        super().collect(model)
+        self.steps.append(model.steps)
+
+    ## Forget the model records collected so far
+    def clear(self):
+        for values in self.model_vars.values():
+            values.clear()
+        self.steps.clear()
+
+    def get_model_vars_dataframe(self):
+        frame = super().get_model_vars_dataframe()
+        frame.index = pd.Index(self.steps, name="Step")
+        return frame
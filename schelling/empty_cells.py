@@ -0,0 +1,27 @@
+class EmptyCells:
+    ## Empty cells kept in a list, plus a map from each cell to its slot in the list.
+    ## Removing a cell swaps the last cell into its slot, so add, remove and sample are all O(1).
+    def __init__(self, cells):
+        self.cells = list(cells)
+        self.slots = {pos: i for i, pos in enumerate(self.cells)}
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, pos):
+        return pos in self.slots
+
+    def add(self, pos):
+        self.slots[pos] = len(self.cells)
+        self.cells.append(pos)
+
+    def remove(self, pos):
+        slot = self.slots.pop(pos)
+        last = self.cells.pop()
+        if slot < len(self.cells):
+            self.cells[slot] = last
+            self.slots[last] = slot
+
+    ## Pick an empty cell uniformly at random
+    def sample(self, random):
+        return self.cells[random.randrange(len(self.cells))]
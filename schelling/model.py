@@ -1,12 +1,53 @@
+import os
+import sys
+import hashlib
+from collections import deque
+import numpy as np
 from mesa import Model
 from mesa.space import SingleGrid
 from agents import SchellingAgent
-from mesa.datacollection import DataCollector
+from array_engine import ArrayEngine, EMPTY
+from sharded import ShardedEngine
+from neighbor_counts import NeighborCounts, SummedAreaCounts
+from empty_cells import EmptyCells
+from trajectory import TrajectoryRecorder
+## Modules shared by the projects, such as profiling.py, live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from profiling import PhaseProfiler
+from collector import StepDataCollector
+
+## Phases of a step and event counters recorded by the model's profiler
+PROFILE_PHASES = ("move", "relocate", "convergence", "collect", "record")
+PROFILE_COUNTERS = ("activations", "moves", "happy_spot_misses")
 
 class SchellingModel(Model):
     ## Define initiation, requiring all needed parameter inputs
-    def __init__(self, width = 50, height = 50, density = 0.7, desired_share_alike = 0.5, 
-                 group_one_share = 0.7, radius = 1, friction=0.3, seed = None): # Modification: I added "friction" parameter.
+    ## engine: "mesa" steps SchellingAgent objects on a SingleGrid, "numpy" keeps the grid as an array (for large grids),
+    ## "sharded" splits the numpy engine's grid across `workers` processes (default: one per core)
+    ## neighborhood (mesa engine): "scan" looks up every neighbor each step, "incremental" keeps per-cell neighbor counts,
+    ## "sat" answers neighbor counts from summed-area tables at a cost that does not depend on radius
+    ## activation (mesa engine): "all" activates every agent each step, "active" only those that are unhappy
+    ## or whose neighborhood changed during the previous step
+    ## relocation (mesa engine): "grid" uses SingleGrid.move_to_empty, "indexed" samples a maintained index of
+    ## empty cells, "happy" samples up to happy_spot_tries empty cells for one where the agent would be happy
+    ## Convergence (all off by default): stop once share_happy has stayed within plateau_tolerance for
+    ## plateau_window steps, once no agent has moved for idle_steps steps, or, with detect_cycles, once
+    ## the grid returns to a state it was already in
+    ## record_to: path of a trajectory file to record the run into (see trajectory.py), with a full grid every keyframe_every steps
+    ## collection: when the datacollector records the reporters. "step" after every step, a number k every k steps,
+    ## "final" only the latest step (earlier records are dropped). The initial state and the step the run
+    ## converges at are always recorded, and so is the last step once close() is called at the end of a run.
+    ## collected_steps lists the step of every record, which also labels the rows of
+    ## datacollector.get_model_vars_dataframe().
+    ## profile: True records the wall time and calls of each phase of a step (PROFILE_PHASES) and counts
+    ## activations, moves and relocation="happy" fallbacks in model.profiler; "collect" also adds them
+    ## to the datacollector, per collection
+    def __init__(self, width = 50, height = 50, density = 0.7, desired_share_alike = 0.5,
+                 group_one_share = 0.7, radius = 1, friction=0.3, seed = None, engine = "mesa",
+                 neighborhood = "scan", activation = "all", relocation = "grid",
+                 happy_spot_tries = 20, plateau_window = None, plateau_tolerance = 0.0,
+                 idle_steps = None, detect_cycles = False, record_to = None,
+                 keyframe_every = 50, workers = None, collection = "step", profile = False): # Modification: I added "friction" parameter.
         ## Inherit seed trait from parent class
         super().__init__(seed=seed)
         ## Define parameter values for model instance
@@ -17,33 +58,269 @@ class SchellingModel(Model):
         self.group_one_share = group_one_share
         self.radius = radius
         self.friction = friction # Modification: I added "friction" parameter.
-        ## Create grid
-        self.grid = SingleGrid(width, height, torus = True)
+        self.engine = engine
+        self.neighborhood = neighborhood
+        self.activation = activation
+        self.relocation = relocation
+        self.happy_spot_tries = happy_spot_tries
+        ## neighborhood, activation and relocation are options of the mesa engine. The array engines judge
+        ## every agent at once and relocate by their own rule, so only the defaults go with them.
+        if neighborhood not in ("scan", "incremental", "sat"):
+            raise ValueError(f"Unknown neighborhood {neighborhood!r}, must be 'scan', 'incremental' or 'sat'")
+        if engine != "mesa" and neighborhood != "scan":
+            raise ValueError(f"neighborhood={neighborhood!r} needs engine='mesa', not {engine!r}")
+        if activation not in ("all", "active"):
+            raise ValueError(f"Unknown activation {activation!r}, must be 'all' or 'active'")
+        if engine != "mesa" and activation != "all":
+            raise ValueError(f"activation={activation!r} needs engine='mesa', not {engine!r}")
+        if relocation not in ("grid", "indexed", "happy"):
+            raise ValueError(f"Unknown relocation {relocation!r}, must be 'grid', 'indexed' or 'happy'")
+        if engine != "mesa" and relocation != "grid":
+            raise ValueError(f"relocation={relocation!r} needs engine='mesa', not {engine!r}")
+        if collection not in ("step", "final") and not (isinstance(collection, (int, np.integer)) and collection > 0):
+            raise ValueError(f"Unknown collection {collection!r}, must be 'step', 'final' or a number of steps")
+        self.collection = collection
+        self.profiler = PhaseProfiler(enabled = bool(profile))
+        self.counts = None
+        ## Agents to activate next step under active-set scheduling (a dict keeps the order reproducible)
+        self.dirty = None
+        self.empty_cells = None
+        self.recorder = None
+        self.plateau_window = plateau_window
+        self.plateau_tolerance = plateau_tolerance
+        self.idle_steps = idle_steps
+        self.detect_cycles = detect_cycles
         ## Instantiate global happiness tracker
         self.happy = 0
+        ## Number of relocations in the current step
+        self.moves = 0
+        ## Why and at which step the run stopped, once it has
+        self.convergence_reason = None
+        self.convergence_step = None
+        ## share_happy over the last plateau_window steps, only kept when a plateau is looked for
+        self.recent_share_happy = deque(maxlen=plateau_window) if plateau_window is not None else None
+        self.idle_count = 0
+        self.seen_states = set()
         ## Define data collector, to collect happy agents and share of agents currently happy
-        self.datacollector = DataCollector(
+        self.datacollector = StepDataCollector(
             model_reporters = {
                 "happy" : "happy",
-                "share_happy" : lambda m : (m.happy / len(m.agents)) * 100
-                if len(m.agents) > 0
-                else 0
+                "share_happy" : lambda m : m.share_happy(),
+                "convergence_reason" : "convergence_reason",
+                "convergence_step" : "convergence_step",
+                **(self.profiler.reporters(PROFILE_PHASES, PROFILE_COUNTERS) if profile == "collect" else {}),
             }
         )
-        ## Place agents randomly around the grid, randomly assigning them to agent types.
-        for cont, pos in self.grid.coord_iter():
-            if self.random.random() < self.density:
-                if self.random.random() < self.group_one_share:
-                    self.grid.place_agent(SchellingAgent(self, 1), pos)
-                else:
-                    self.grid.place_agent(SchellingAgent(self, 0), pos)
+        if engine == "numpy":
+            self.array = ArrayEngine(self)
+            self.num_agents = self.array.num_agents
+        elif engine == "sharded":
+            self.array = ShardedEngine(self, workers)
+            self.num_agents = self.array.num_agents
+        elif engine == "mesa":
+            ## Create grid
+            self.grid = SingleGrid(width, height, torus = True)
+            ## Place agents randomly around the grid, randomly assigning them to agent types.
+            for pos, agent_type in self.initial_types():
+                self.grid.place_agent(SchellingAgent(self, agent_type), pos)
+            self.num_agents = len(self.agents)
+            if neighborhood == "incremental":
+                self.counts = NeighborCounts(width, height, radius, self.agents)
+            elif neighborhood == "sat":
+                self.counts = SummedAreaCounts(width, height, radius, self.agents)
+            if activation == "active":
+                self.dirty = dict.fromkeys(self.agents)
+            if relocation in ("indexed", "happy"):
+                self.empty_cells = EmptyCells(pos for _, pos in self.grid.coord_iter() if self.grid.is_cell_empty(pos))
+        else:
+            raise ValueError(f"Unknown engine {engine!r}, must be 'mesa', 'numpy' or 'sharded'")
+        if detect_cycles:
+            self.seen_states.add(self.state_hash())
+        if record_to is not None:
+            self.recorder = TrajectoryRecorder(record_to, self, keyframe_every)
         ## Initialize datacollector
-        self.datacollector.collect(self)
+        self.collect()
+
+    ## Share of agents currently happy, in percent
+    def share_happy(self):
+        if self.num_agents > 0:
+            return (self.happy / self.num_agents) * 100
+        return 0
+
+    ## The grid as an array of agent types, EMPTY where no agent lives
+    def type_grid(self):
+        if self.engine != "mesa":
+            return self.array.types
+        if self.counts is not None:
+            return self.counts.types
+        types = np.full((self.width, self.height), EMPTY, dtype=np.int8)
+        for agent in self.agents:
+            types[agent.pos] = agent.type
+        return types
+
+    ## The grid as an array of agent unique_ids, 0 where no agent lives
+    def id_grid(self):
+        if self.engine != "mesa":
+            return self.array.ids
+        ids = np.zeros((self.width, self.height), dtype=np.uint32)
+        for agent in self.agents:
+            ids[agent.pos] = agent.unique_id
+        return ids
+
+    ## Fingerprint of the current grid, used to notice a run revisiting an earlier state
+    def state_hash(self):
+        return hashlib.blake2b(self.type_grid().tobytes(), digest_size=16).digest()
+
+    ## Walk the grid cell by cell, deciding whether each cell is occupied and by which agent type.
+    ## Both engines draw from the same seeded generator, so a seed gives the same starting grid.
+    def initial_types(self):
+        for x in range(self.width):
+            for y in range(self.height):
+                if self.random.random() < self.density:
+                    if self.random.random() < self.group_one_share:
+                        yield (x, y), 1
+                    else:
+                        yield (x, y), 0
+
+    ## Move an agent to a random empty cell, keeping the neighbor counts up to date
+    def relocate(self, agent):
+        old_pos = agent.pos
+        if self.empty_cells is None:
+            self.grid.move_to_empty(agent)
+        else:
+            new_pos = self.find_empty(agent)
+            self.empty_cells.remove(new_pos)
+            self.empty_cells.add(old_pos)
+            self.grid.move_agent(agent, new_pos)
+        self.moves += 1
+        if self.recorder is not None:
+            self.recorder.record_move(agent.unique_id, old_pos, agent.pos)
+        if self.counts is not None:
+            self.counts.move(old_pos, agent.pos, agent.type)
+        ## Everyone who could see the old or the new cell has a changed neighborhood
+        if self.dirty is not None:
+            for pos in (old_pos, agent.pos):
+                for neighbor in self.grid.iter_neighbors(pos, moore = True, radius = self.radius):
+                    self.dirty[neighbor] = None
+
+    ## Pick a destination from the empty-cell index: a uniformly random empty cell, or with relocation="happy",
+    ## the first of a few random empty cells where the agent would be happy (falling back to the first draw)
+    def find_empty(self, agent):
+        if len(self.empty_cells) == 0:
+            raise Exception("ERROR: No empty cells")
+        first = self.empty_cells.sample(self.random)
+        if self.relocation == "happy":
+            candidate = first
+            for _ in range(self.happy_spot_tries):
+                if self.share_alike_at(agent, candidate) >= self.desired_share_alike:
+                    return candidate
+                candidate = self.empty_cells.sample(self.random)
+            self.profiler.count("happy_spot_misses")
+        return first
+
+    ## Share of same-type neighbors the agent would have at an empty cell, leaving itself out
+    def share_alike_at(self, agent, pos):
+        if self.counts is not None:
+            similar_neighbors, valid_neighbors = self.counts.neighbors(pos, agent.type)
+            if self.within_radius(pos, agent.pos):
+                similar_neighbors -= 1
+                valid_neighbors -= 1
+        else:
+            neighbors = [n for n in self.grid.iter_neighbors(pos, moore = True, radius = self.radius) if n is not agent]
+            similar_neighbors = len([n for n in neighbors if n.type == agent.type])
+            valid_neighbors = len(neighbors)
+        if valid_neighbors > 0:
+            return similar_neighbors / valid_neighbors
+        return 0
+
+    ## Whether two cells are within radius of each other on the torus (Moore distance)
+    def within_radius(self, pos, other):
+        dx = abs(pos[0] - other[0])
+        dy = abs(pos[1] - other[1])
+        return min(dx, self.width - dx) <= self.radius and min(dy, self.height - dy) <= self.radius
+
+    ## Activate only the dirty agents, in random order. Everyone else keeps the happiness
+    ## they had when last activated, since nothing around them has changed since.
+    def step_active(self):
+        active = list(self.dirty)
+        self.dirty = {}
+        self.profiler.count("activations", len(active))
+        self.happy -= sum(agent.is_happy for agent in active)
+        self.random.shuffle(active)
+        for agent in active:
+            agent.move()
+
+    ## Check whether the run has settled, and if so record why and when
+    def check_convergence(self):
+        if self.recent_share_happy is not None:
+            self.recent_share_happy.append(self.share_happy())
+        self.idle_count = self.idle_count + 1 if self.moves == 0 else 0
+        if self.happy >= self.num_agents:
+            reason = "all_happy"
+        elif (self.recent_share_happy is not None and len(self.recent_share_happy) == self.plateau_window
+              and max(self.recent_share_happy) - min(self.recent_share_happy) <= self.plateau_tolerance):
+            reason = "plateau"
+        elif self.idle_steps is not None and self.idle_count >= self.idle_steps:
+            reason = "no_moves"
+        ## A step without moves leaves the grid as it was, which idle_steps is for, not a cycle
+        elif self.detect_cycles and self.moves > 0 and (state := self.state_hash()) in self.seen_states:
+            reason = "cycle"
+        else:
+            if self.detect_cycles and self.moves > 0:
+                self.seen_states.add(state)
+            return
+        self.convergence_reason = reason
+        self.convergence_step = self.steps
 
     ## Define a step: reset global happiness tracker, agents move in random order, collect data
     def step(self):
-        self.happy = 0
-        self.agents.shuffle_do("move")
-        self.datacollector.collect(self)
-        ## Run model until all agents are happy
-        self.running = self.happy < len(self.agents)
+        profiler = self.profiler
+        self.moves = 0
+        with profiler.phase("move"):
+            if self.engine != "mesa":
+                self.array.step()
+                profiler.count("activations", self.num_agents)
+            elif self.dirty is not None:
+                self.step_active()
+            else:
+                self.happy = 0
+                self.agents.shuffle_do("move")
+                profiler.count("activations", self.num_agents)
+        profiler.count("moves", self.moves)
+        with profiler.phase("convergence"):
+            self.check_convergence()
+        self.collect()
+        ## Run model until all agents are happy, or until it has otherwise converged
+        self.running = self.convergence_reason is None
+        if self.recorder is not None:
+            with profiler.phase("record"):
+                self.recorder.end_step(self)
+        if not self.running:
+            self.close()
+
+    ## Step of every record of the data collector
+    @property
+    def collected_steps(self):
+        return self.datacollector.steps
+
+    ## Record the reporters if the collection policy asks for this step, or always
+    def collect(self, always = False):
+        due = self.collection in ("step", "final") or self.steps % self.collection == 0
+        if not (due or always or self.convergence_reason is not None):
+            return
+        if self.collection == "final":
+            self.datacollector.clear()
+        with self.profiler.phase("collect"):
+            self.datacollector.collect(self)
+            # before the phase ends, so the time of this collection is reported by the next one
+            self.profiler.mark_collected()
+
+    ## Finish the run: record its last step if the collection policy skipped it, finish side outputs such as
+    ## the trajectory file, and stop the sharded engine's workers. Call this when stopping a run early.
+    def close(self):
+        if self.collected_steps[-1] != self.steps:
+            self.collect(always = True)
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.engine == "sharded":
+            self.array.close()
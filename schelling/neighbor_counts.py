@@ -0,0 +1,139 @@
+import numpy as np
+from array_engine import EMPTY, neighbor_counts
+
+## Offsets of the cells within radius along one torus axis, each wrapped cell listed once
+def axis_offsets(size, radius):
+    if 2 * radius + 1 >= size:
+        return np.arange(size)
+    return np.arange(-radius, radius + 1)
+
+class NeighborCounts:
+    ## Per-cell counts of each agent type within radius (Moore, torus, center excluded).
+    ## Counts are built once, then patched around the old and new cell whenever an agent moves.
+    def __init__(self, width, height, radius, agents):
+        self.width = width
+        self.height = height
+        self.types = np.full((width, height), EMPTY, dtype=np.int8)
+        for agent in agents:
+            self.types[agent.pos] = agent.type
+        self.counts = np.stack([neighbor_counts(self.types, 0, radius),
+                                neighbor_counts(self.types, 1, radius)])
+        self.x_offsets = axis_offsets(width, radius)
+        self.y_offsets = axis_offsets(height, radius)
+
+    ## Return the number of same-type neighbors and of all neighbors around pos
+    def neighbors(self, pos, agent_type):
+        same = int(self.counts[agent_type][pos])
+        return same, same + int(self.counts[1 - agent_type][pos])
+
+    ## Add delta to the counts of every cell that sees pos, which costs O(radius^2)
+    def update(self, pos, agent_type, delta):
+        x, y = pos
+        counts = self.counts[agent_type]
+        ## Use plain slices away from the borders, and wrapped index arrays near them
+        x_lo, x_hi = x + self.x_offsets[0], x + self.x_offsets[-1] + 1
+        y_lo, y_hi = y + self.y_offsets[0], y + self.y_offsets[-1] + 1
+        if x_lo >= 0 and x_hi <= self.width and y_lo >= 0 and y_hi <= self.height:
+            counts[x_lo:x_hi, y_lo:y_hi] += delta
+        else:
+            rows = (x + self.x_offsets) % self.width
+            cols = (y + self.y_offsets) % self.height
+            counts[rows[:, None], cols] += delta
+        counts[x, y] -= delta
+
+    def move(self, old_pos, new_pos, agent_type):
+        self.update(old_pos, agent_type, -1)
+        self.types[old_pos] = EMPTY
+        self.update(new_pos, agent_type, 1)
+        self.types[new_pos] = agent_type
+
+class SummedAreaCounts:
+    ## Same queries as NeighborCounts, answered from summed-area tables (integral images) of each
+    ## type's occupancy, so a query costs the same for any radius. Moves made since the tables were
+    ## built are kept as pending changes and added on top of the table sums. Once max_pending changes
+    ## pile up, the tables are rebuilt in one vectorized pass.
+    def __init__(self, width, height, radius, agents, max_pending = None):
+        self.width = width
+        self.height = height
+        self.radius = radius
+        self.types = np.full((width, height), EMPTY, dtype=np.int8)
+        for agent in agents:
+            self.types[agent.pos] = agent.type
+        ## A window wider than the torus covers each row or column once, like SingleGrid's neighborhood
+        self.x_full = 2 * radius + 1 >= width
+        self.y_full = 2 * radius + 1 >= height
+        self.x_window = width if self.x_full else 2 * radius + 1
+        self.y_window = height if self.y_full else 2 * radius + 1
+        ## Pending changes are bucketed by tile, so a query only looks at the tiles its window overlaps.
+        ## Tiles are at least 2r+1 cells wide, so a window overlaps at most two tiles along each axis.
+        self.x_tiles = max(1, width // (2 * radius + 1))
+        self.y_tiles = max(1, height // (2 * radius + 1))
+        ## By default, rebuild once about one pending change per window's worth of cells has piled up,
+        ## so a query scans a handful of changes whatever the radius
+        if max_pending is None:
+            max_pending = max(256, width * height // (self.x_window * self.y_window))
+        self.max_pending = max_pending
+        self.rebuild()
+
+    ## Build one table per type over the occupancy grid, padded with the wrapped-around borders
+    def rebuild(self):
+        x_pad = 0 if self.x_full else self.radius
+        y_pad = 0 if self.y_full else self.radius
+        occupied = np.stack([self.types == 0, self.types == 1]).astype(np.int32)
+        padded = np.pad(occupied, ((0, 0), (x_pad, x_pad), (y_pad, y_pad)), mode = "wrap")
+        tables = np.zeros((2, padded.shape[1] + 1, padded.shape[2] + 1), dtype=np.int32)
+        np.cumsum(padded, axis=1, out=tables[:, 1:, 1:])
+        np.cumsum(tables[:, 1:, 1:], axis=2, out=tables[:, 1:, 1:])
+        self.tables = list(tables)
+        ## Pending changes as (x, y, agent type, +1 or -1), keyed by tile
+        self.pending = {}
+        self.num_pending = 0
+
+    def tile(self, x, y):
+        return x * self.x_tiles // self.width, y * self.y_tiles // self.height
+
+    ## Number of agents in the window around x, y, center included, as of the last rebuild
+    def box(self, table, x, y):
+        top = 0 if self.x_full else x
+        left = 0 if self.y_full else y
+        bottom = top + self.x_window
+        right = left + self.y_window
+        return table.item(bottom, right) - table.item(top, right) - table.item(bottom, left) + table.item(top, left)
+
+    ## Return the number of same-type neighbors and of all neighbors around pos
+    def neighbors(self, pos, agent_type):
+        x, y = pos
+        same = self.box(self.tables[agent_type], x, y)
+        other = self.box(self.tables[1 - agent_type], x, y)
+        ## Add the changes made since the last rebuild that fall inside the window
+        if self.num_pending > 0:
+            r, width, height = self.radius, self.width, self.height
+            x_tiles = {(x - r) % width * self.x_tiles // width, (x + r) % width * self.x_tiles // width}
+            y_tiles = {(y - r) % height * self.y_tiles // height, (y + r) % height * self.y_tiles // height}
+            for tile_x in x_tiles:
+                for tile_y in y_tiles:
+                    for change_x, change_y, change_type, delta in self.pending.get((tile_x, tile_y), ()):
+                        dx = abs(change_x - x)
+                        dy = abs(change_y - y)
+                        if min(dx, width - dx) <= r and min(dy, height - dy) <= r:
+                            if change_type == agent_type:
+                                same += delta
+                            else:
+                                other += delta
+        ## Leave out whoever sits in the center cell
+        center = self.types.item(x, y)
+        if center == agent_type:
+            same -= 1
+        elif center != EMPTY:
+            other -= 1
+        return same, same + other
+
+    def move(self, old_pos, new_pos, agent_type):
+        self.types[old_pos] = EMPTY
+        self.types[new_pos] = agent_type
+        if self.num_pending + 2 > self.max_pending:
+            self.rebuild()
+            return
+        self.pending.setdefault(self.tile(*old_pos), []).append((old_pos[0], old_pos[1], agent_type, -1))
+        self.pending.setdefault(self.tile(*new_pos), []).append((new_pos[0], new_pos[1], agent_type, 1))
+        self.num_pending += 2
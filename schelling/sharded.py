@@ -0,0 +1,173 @@
+import os
+import weakref
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from array_engine import ArrayEngine, EMPTY, window_sum
+
+## Arrays shared by the coordinator and the workers, each the size of the grid (flat except for the grids):
+##   types, ids: the grid itself
+##   movers, empties: each tile's movers / empty cells of the current step, in the tile's own slice
+##   mail_src, mail_type, mail_id: agents on their way to another cell, grouped by destination tile
+SHARED = {"types": np.int8, "ids": np.uint32, "movers": np.int64, "empties": np.int64,
+          "mail_src": np.int64, "mail_type": np.int8, "mail_id": np.uint32}
+
+## Shared arrays, attached once per worker
+_shared = {}
+
+def attach(names, shape):
+    ## Workers share the coordinator's resource tracker, which unlinks the blocks once the coordinator does
+    for key, name in names.items():
+        memory = SharedMemory(name=name)
+        _shared[key + "_memory"] = memory
+        _shared[key] = np.ndarray(shape if key in ("types", "ids") else (shape[0] * shape[1],),
+                                  dtype=SHARED[key], buffer=memory.buf)
+
+## Count each type's neighbors for the rows x0..x1 of the grid. The strip is read together with
+## radius halo rows on either side (wrapped around the torus), so no other tile is needed.
+def strip_counts(types, x0, x1, radius):
+    width = types.shape[0]
+    strip = types[x0:x1]
+    counts = []
+    for agent_type in (0, 1):
+        if 2 * radius + 1 >= width:
+            ## The window covers every row once, as in SingleGrid's neighborhood
+            column_totals = (types == agent_type).sum(axis=0, keepdims=True, dtype=np.int32)
+            rows = np.repeat(column_totals, x1 - x0, axis=0)
+        else:
+            halo = (types.take(range(x0 - radius, x1 + radius), axis=0, mode="wrap") == agent_type).astype(np.int32)
+            running = np.concatenate([np.zeros((1, types.shape[1]), dtype=np.int32), halo.cumsum(axis=0)])
+            rows = running[2 * radius + 1:] - running[:x1 - x0]
+        counts.append(window_sum(rows, radius, 1) - (strip == agent_type))
+    return counts
+
+## Phase 1, one tile: judge every agent in the tile and draw the friction rolls. The tile's movers and
+## empty cells stay in shared memory; only the counts go back to the coordinator.
+def judge_tile(task):
+    x0, x1, radius, desired_share_alike, friction, seed = task
+    types = _shared["types"]
+    strip = types[x0:x1]
+    type_zero, type_one = strip_counts(types, x0, x1, radius)
+    same_type = np.where(strip == 1, type_one, type_zero)
+    valid_neighbors = type_one + type_zero
+    share_alike = np.divide(same_type, valid_neighbors, out=np.zeros(strip.shape), where=valid_neighbors > 0)
+    occupied = strip != EMPTY
+    happy = occupied & (share_alike >= desired_share_alike)
+    offset = x0 * types.shape[1]
+    unhappy = np.flatnonzero(occupied & ~happy) + offset
+    rng = np.random.default_rng(seed)
+    movers = unhappy[rng.random(unhappy.size) > friction]
+    empties = np.flatnonzero(~occupied) + offset
+    _shared["movers"][offset:offset + movers.size] = movers
+    _shared["empties"][offset:offset + empties.size] = empties
+    return int(happy.sum()), movers.size, empties.size
+
+## Phase 2, one source tile: pick which of its movers leave, post them (cell, type, id) to the mailbox
+## slots of their destination tiles and empty their cells
+def send_tile(task):
+    offset, num_movers, flows, slots, seed = task
+    rng = np.random.default_rng(seed)
+    leaving = rng.permutation(_shared["movers"][offset:offset + num_movers])[:flows.sum()]
+    ## Consecutive runs of leaving go to consecutive destination tiles, each into its own mailbox slot
+    starts = np.cumsum(flows) - flows
+    targets = np.repeat(slots - starts, flows) + np.arange(leaving.size)
+    types, ids = _shared["types"].reshape(-1), _shared["ids"].reshape(-1)
+    _shared["mail_src"][targets] = leaving
+    _shared["mail_type"][targets] = types[leaving]
+    _shared["mail_id"][targets] = ids[leaving]
+    types[leaving] = EMPTY
+    ids[leaving] = 0
+
+## Phase 3, one destination tile: place the agents posted to it on distinct random cells that were empty
+## at the start of the step. Returns the moves (agent ids, from, to) when the run is recorded.
+def receive_tile(task):
+    offset, num_empties, start, count, seed, record = task
+    rng = np.random.default_rng(seed)
+    destinations = rng.choice(_shared["empties"][offset:offset + num_empties], size=count, replace=False)
+    arriving = slice(start, start + count)
+    _shared["types"].reshape(-1)[destinations] = _shared["mail_type"][arriving]
+    _shared["ids"].reshape(-1)[destinations] = _shared["mail_id"][arriving]
+    if record:
+        return _shared["mail_id"][arriving].copy(), _shared["mail_src"][arriving].copy(), destinations
+
+def shut_down(pool, memories):
+    pool.terminate()
+    pool.join()
+    for memory in memories:
+        memory.close()
+        memory.unlink()
+
+class ShardedEngine(ArrayEngine):
+    ## The numpy engine split across worker processes. The grid and all per-step scratch arrays live in
+    ## shared memory, and the grid is cut into strips of rows, one per worker. A step has three parallel
+    ## phases, and only counts pass through the coordinator between them:
+    ##   1. every tile judges its agents (reading radius halo rows of its neighbors) and keeps its movers
+    ##      and empty cells in shared memory;
+    ##   2. from the tiles' counts, the coordinator draws how many movers leave each tile and how many land
+    ##      in each tile, and how many go from each tile to each other tile (O(tiles²) draws). Every tile
+    ##      then sends its leaving agents to mailbox slots of their destination tiles;
+    ##   3. every tile places the agents in its mailbox slot on random cells that were empty.
+    ## This is the numpy engine's relocation rule (a random subset of the movers goes to distinct random
+    ## empty cells, paired at random) with the draws split by tile. All draws come from the model's
+    ## generator or from per-(step, tile, phase) generators derived from the model seed, so a run is
+    ## deterministic for a given seed and number of workers.
+    def __init__(self, model, workers = None):
+        super().__init__(model)
+        workers = min(workers or os.cpu_count() or 1, model.width)
+        self.bounds = np.linspace(0, model.width, workers + 1).astype(int)
+        self.offsets = self.bounds[:-1] * model.height
+        cells = model.width * model.height
+        self.memories = {key: SharedMemory(create=True, size=cells * np.dtype(dtype).itemsize)
+                         for key, dtype in SHARED.items()}
+        for key in ("types", "ids"):
+            shared = np.ndarray(self.types.shape, dtype=SHARED[key], buffer=self.memories[key].buf)
+            shared[:] = getattr(self, key)
+            setattr(self, key, shared)
+        self.base_seed = int(model.rng.integers(2**63))
+        self.pool = multiprocessing.Pool(workers, initializer=attach,
+                                         initargs=({key: memory.name for key, memory in self.memories.items()},
+                                                   self.types.shape))
+        self.finalizer = weakref.finalize(self, shut_down, self.pool, list(self.memories.values()))
+
+    def step(self):
+        model = self.model
+        tiles = range(len(self.offsets))
+        tasks = [(int(x0), int(x1), model.radius, model.desired_share_alike, model.friction,
+                  (self.base_seed, model.steps, tile, 0))
+                 for tile, (x0, x1) in enumerate(zip(self.bounds[:-1], self.bounds[1:]))]
+        happy, movers, empties = np.array(self.pool.map(judge_tile, tasks)).T
+        model.happy = int(happy.sum())
+        with model.profiler.phase("relocate"):
+            flows = self.draw_flows(movers, empties)
+            model.moves = int(flows.sum())
+            ## Mailbox slot of each (source, destination) pair: grouped by destination, then by source
+            slots = (np.cumsum(flows.T.reshape(-1)) - flows.T.reshape(-1)).reshape(flows.shape).T
+            self.pool.map(send_tile, [(int(self.offsets[tile]), int(movers[tile]), flows[tile], slots[tile],
+                                       (self.base_seed, model.steps, tile, 1)) for tile in tiles])
+            arrivals = flows.sum(axis=0)
+            record = model.recorder is not None
+            moves = self.pool.map(receive_tile, [(int(self.offsets[tile]), int(empties[tile]), int(slots[0, tile]),
+                                                  int(arrivals[tile]), (self.base_seed, model.steps, tile, 2), record)
+                                                 for tile in tiles])
+            if record:
+                model.recorder.record_moves(*(np.concatenate(parts) for parts in zip(*moves)))
+
+    ## Number of agents moving from each tile (rows) to each tile (columns). As many movers move as there
+    ## are empty cells for; which movers move, where they land and who goes where are all uniformly random.
+    def draw_flows(self, movers, empties):
+        rng = self.model.rng
+        total = min(movers.sum(), empties.sum())
+        leaving = rng.multivariate_hypergeometric(movers, total) if movers.sum() > total else movers
+        arriving = rng.multivariate_hypergeometric(empties, total)
+        flows = np.zeros((len(movers), len(empties)), dtype=np.int64)
+        for tile, count in enumerate(leaving):
+            flows[tile] = rng.multivariate_hypergeometric(arriving, count)
+            arriving = arriving - flows[tile]
+        return flows
+
+    ## Stop the workers and release the shared arrays
+    def close(self):
+        if self.finalizer.alive:
+            self.types = np.array(self.types)
+            self.ids = np.array(self.ids)
+            self.finalizer()
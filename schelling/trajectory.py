@@ -0,0 +1,160 @@
+import numpy as np
+from mesa import Model
+from mesa.datacollection import DataCollector
+from array_engine import EMPTY
+
+## File layout (little-endian), every section memory-mappable:
+##   header | initial types (int8, width x height) | initial agent ids (uint32, 0 where empty)
+##   | moves (one MOVE record per relocation, in order) | footer
+## The footer holds, for steps 0..num_steps, the index of the step's first move and the happy count,
+## followed by a full type grid every keyframe_every steps.
+MAGIC = b"SCHTRAJ1"
+HEADER = np.dtype([("magic", "S8"), ("width", "<u4"), ("height", "<u4"), ("num_steps", "<u4"),
+                   ("keyframe_every", "<u4"), ("num_moves", "<u8"), ("footer_offset", "<u8")])
+## Cells are stored as flat indices, x * height + y
+MOVE = np.dtype([("agent", "<u4"), ("src", "<u4"), ("dst", "<u4")])
+
+class TrajectoryRecorder:
+    ## Write the initial grid once, then append each step's moves as they happen
+    def __init__(self, path, model, keyframe_every = 50):
+        self.path = path
+        self.width = model.width
+        self.height = model.height
+        self.keyframe_every = keyframe_every
+        self.file = open(path, "wb")
+        self.file.write(np.zeros(1, dtype=HEADER).tobytes())
+        types, ids = model.type_grid(), model.id_grid()
+        self.file.write(types.astype(np.int8).tobytes())
+        self.file.write(ids.astype("<u4").tobytes())
+        self.buffer = []
+        self.num_moves = 0
+        self.step_starts = [0]
+        self.happy = [model.happy]
+        self.keyframes = []
+
+    ## Record one relocation (mesa engine)
+    def record_move(self, agent_id, old_pos, new_pos):
+        self.buffer.append((agent_id, old_pos[0] * self.height + old_pos[1], new_pos[0] * self.height + new_pos[1]))
+
+    ## Record a batch of relocations given as flat cell indices (numpy engine)
+    def record_moves(self, agent_ids, sources, destinations):
+        moves = np.empty(len(agent_ids), dtype=MOVE)
+        moves["agent"], moves["src"], moves["dst"] = agent_ids, sources, destinations
+        self.write(moves)
+
+    def write(self, moves):
+        self.file.write(moves.tobytes())
+        self.num_moves += len(moves)
+
+    ## Close off a step: flush its moves, note the happy count, and keep a keyframe every keyframe_every steps
+    def end_step(self, model):
+        if self.buffer:
+            self.write(np.array(self.buffer, dtype=MOVE))
+            self.buffer = []
+        self.step_starts.append(self.num_moves)
+        self.happy.append(model.happy)
+        if model.steps % self.keyframe_every == 0:
+            self.keyframes.append(model.type_grid().astype(np.int8))
+
+    ## Write the footer and the final header; safe to call more than once
+    def close(self):
+        if self.file.closed:
+            return
+        footer_offset = self.file.tell()
+        self.file.write(np.array(self.step_starts, dtype="<u8").tobytes())
+        self.file.write(np.array(self.happy, dtype="<i8").tobytes())
+        for keyframe in self.keyframes:
+            self.file.write(keyframe.tobytes())
+        header = np.zeros(1, dtype=HEADER)
+        header[0] = (MAGIC, self.width, self.height, len(self.step_starts) - 1,
+                     self.keyframe_every, self.num_moves, footer_offset)
+        self.file.seek(0)
+        self.file.write(header.tobytes())
+        self.file.close()
+
+## Apply a batch of moves to a flat type grid. The last event at each cell decides what is there.
+def apply_moves(cells, moves, type_of_agent):
+    if len(moves) == 0:
+        return
+    events = np.stack([moves["src"], moves["dst"]], axis=1).reshape(-1)
+    values = np.stack([np.full(len(moves), EMPTY, dtype=np.int8), type_of_agent[moves["agent"]]], axis=1).reshape(-1)
+    _, last = np.unique(events[::-1], return_index=True)
+    cells[events[::-1][last]] = values[::-1][last]
+
+class SchellingReplay(Model):
+    ## Replay a recorded run without re-simulating it. Jumping to a step starts from the nearest
+    ## earlier keyframe, so scrubbing only applies at most keyframe_every steps of moves.
+    def __init__(self, path, start_step = 0):
+        super().__init__()
+        header = np.fromfile(path, dtype=HEADER, count=1)[0]
+        if header["magic"] != MAGIC:
+            raise ValueError(f"{path} is not a closed Schelling trajectory file")
+        self.width = int(header["width"])
+        self.height = int(header["height"])
+        self.num_steps = int(header["num_steps"])
+        self.keyframe_every = int(header["keyframe_every"])
+        num_cells = self.width * self.height
+        offset = HEADER.itemsize
+        self.initial = np.memmap(path, dtype=np.int8, mode="r", offset=offset, shape=(num_cells,))
+        offset += num_cells
+        initial_ids = np.memmap(path, dtype="<u4", mode="r", offset=offset, shape=(num_cells,))
+        offset += 4 * num_cells
+        self.moves = np.memmap(path, dtype=MOVE, mode="r", offset=offset, shape=(int(header["num_moves"]),))
+        offset = int(header["footer_offset"])
+        self.step_starts = np.memmap(path, dtype="<u8", mode="r", offset=offset, shape=(self.num_steps + 1,))
+        offset += 8 * (self.num_steps + 1)
+        self.happy_history = np.memmap(path, dtype="<i8", mode="r", offset=offset, shape=(self.num_steps + 1,))
+        offset += 8 * (self.num_steps + 1)
+        num_keyframes = self.num_steps // self.keyframe_every
+        self.keyframes = np.memmap(path, dtype=np.int8, mode="r", offset=offset, shape=(num_keyframes, num_cells))
+        ## Agent ids never change, so their types can be looked up from the initial grid
+        occupied = initial_ids != 0
+        self.type_of_agent = np.zeros(int(initial_ids.max(initial=0)) + 1, dtype=np.int8)
+        self.type_of_agent[initial_ids[occupied]] = self.initial[occupied]
+        self.num_agents = int(occupied.sum())
+        self.engine = "replay"
+        self.cells = np.array(self.initial)
+        self.happy = int(self.happy_history[0])
+        self.datacollector = DataCollector(
+            model_reporters = {
+                "happy" : "happy",
+                "share_happy" : lambda m : (m.happy / m.num_agents) * 100
+                if m.num_agents > 0
+                else 0
+            }
+        )
+        if start_step:
+            self.seek(start_step)
+        self.running = self.steps < self.num_steps
+        self.datacollector.collect(self)
+
+    ## The grid as an array of agent types, EMPTY where no agent lives
+    def type_grid(self):
+        return self.cells.reshape(self.width, self.height)
+
+    ## Apply the moves of steps first..last (inclusive) to the current grid
+    def apply_steps(self, first, last):
+        start, stop = int(self.step_starts[first - 1]), int(self.step_starts[last])
+        apply_moves(self.cells, self.moves[start:stop], self.type_of_agent)
+
+    ## Jump to any recorded step
+    def seek(self, step):
+        step = min(max(step, 0), self.num_steps)
+        keyframe = step // self.keyframe_every
+        if keyframe > 0:
+            self.cells = np.array(self.keyframes[keyframe - 1])
+        else:
+            self.cells = np.array(self.initial)
+        if step > keyframe * self.keyframe_every:
+            self.apply_steps(keyframe * self.keyframe_every + 1, step)
+        self.steps = step
+        self.happy = int(self.happy_history[step])
+
+    def step(self):
+        if self.steps > self.num_steps:
+            self.steps = self.num_steps
+        else:
+            self.apply_steps(self.steps, self.steps)
+            self.happy = int(self.happy_history[self.steps])
+        self.datacollector.collect(self)
+        self.running = self.steps < self.num_steps
@@ -0,0 +1,216 @@
+import os
+import json
+import hashlib
+import multiprocessing
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from tqdm.auto import tqdm
+from mesa.batchrunner import _make_model_kwargs
+from run_cache import RunCache, resolve_parameters
+
+## Sweep runner for StrategyModel (final/) and SchellingModel (schelling/), a drop-in for mesa's batch_run:
+##   * every run gets a seed derived from (seed, parameter point, iteration), so results do not depend on
+##     how the runs are scheduled, and a sweep can be repeated or resumed exactly;
+##   * runs are spread over a process pool in chunks, and their rows are streamed back as runs finish;
+##   * with a journal file, finished runs are appended to it, and an interrupted sweep picks up from there;
+##   * with a run cache, runs computed by any earlier sweep are fetched instead of simulated again.
+
+## Environment variables that size the thread pools of the BLAS / OpenMP libraries behind NumPy and SciPy
+THREAD_LIMITS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                 "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+## Turn NumPy scalars into plain Python values, for hashing and for the journal
+def plain(value):
+    return value.item() if hasattr(value, "item") else str(value)
+
+def digest(*parts):
+    key = json.dumps(parts, default=plain, sort_keys=True)
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+## Model parameters that only choose what is recorded (steps collected, profiling), not what happens in a run
+RECORDING_PARAMETERS = ("collection", "profile")
+
+## The seed of one run, derived from the sweep's seed, the run's full parameter point and its iteration,
+## so the same point gets the same seeds in every sweep that includes it. Recording parameters are left out.
+def derive_seed(seed, model_cls, kwargs, iteration):
+    parameters = resolve_parameters(model_cls, kwargs)
+    for name in RECORDING_PARAMETERS:
+        parameters.pop(name, None)
+    return digest(seed, parameters, iteration) >> 1
+
+## Expand the parameters like batch_run: every combination of values, repeated for each iteration.
+## Runs that don't set a seed get a derived one.
+def make_runs(model_cls, parameters, iterations, seed):
+    runs = []
+    for iteration in range(iterations):
+        for kwargs in _make_model_kwargs(parameters):
+            if "seed" not in kwargs:
+                kwargs["seed"] = derive_seed(seed, model_cls, kwargs, iteration)
+            runs.append((len(runs), iteration, kwargs))
+    return runs
+
+## Run one model until it stops or passes max_steps, like batch_run, and return its collected steps in
+## batch_run's layout, as columns: RunId, iteration, Step, the parameters and the reporters.
+## (Neither model has agent reporters, so there is one row per collected step.)
+def run_model(task):
+    model_cls, run_id, iteration, kwargs, max_steps, data_collection_period, collection = task
+    model = model_cls(**kwargs) if collection is None else model_cls(**kwargs, collection=collection)
+    datacollector = model.datacollector
+    if hasattr(datacollector, "reserve") and collection in (None, "step"):
+        ## Room for the initial collection and one per step
+        datacollector.reserve(max_steps + 2)
+    while model.running and model.steps <= max_steps:
+        model.step()
+    if hasattr(model, "close"):
+        model.close()
+    collected = getattr(model, "collected_steps", None)
+    if collected is None or len(collected) == model.steps + 1:
+        ## Every step was recorded: keep the steps batch_run keeps
+        steps = list(range(0, model.steps, data_collection_period))
+        if not steps or steps[-1] != model.steps - 1:
+            steps.append(model.steps - 1)
+        indices = steps = np.array(steps)
+    else:
+        ## Keep the recorded steps that fall on the period, and the last one
+        collected = np.array(collected)
+        keep = collected % data_collection_period == 0 if data_collection_period > 0 else np.zeros(len(collected), bool)
+        keep[-1] = True
+        indices = np.flatnonzero(keep)
+        steps = collected[indices]
+    if hasattr(datacollector, "take"):
+        reporters = datacollector.take(indices)
+    else:
+        reporters = {name: np.asarray(values)[indices] for name, values in datacollector.model_vars.items()}
+    return run_id, run_columns(run_id, iteration, kwargs, {"Step": steps, **reporters})
+
+## Columns of a run: the run's identity and parameters, repeated for each collected step, and the
+## columns of what it computed (Step and the reporters)
+def run_columns(run_id, iteration, kwargs, computed):
+    length = len(computed["Step"])
+    return {"RunId": np.full(length, run_id), "iteration": np.full(length, iteration),
+            "Step": np.asarray(computed["Step"]),
+            **{name: np.full(length, value) for name, value in kwargs.items()},
+            **{name: np.asarray(values) for name, values in computed.items() if name != "Step"}}
+
+## Rows of a run, as batch_run returns them
+def run_rows(columns):
+    return [dict(zip(columns, values)) for values in zip(*(np.asarray(column).tolist() for column in columns.values()))]
+
+## Identifies a run in the journal independently of its RunId, which depends on the rest of the sweep
+def run_key(model_cls, iteration, kwargs, max_steps, data_collection_period, collection):
+    return f"{digest(model_cls.__module__, model_cls.__qualname__, iteration, kwargs, max_steps, data_collection_period, collection):016x}"
+
+def read_journal(journal):
+    finished = {}
+    if os.path.exists(journal):
+        with open(journal) as file:
+            for line in file:
+                ## A line cut off by an interruption is simply run again
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                finished[entry["key"]] = entry["columns"]
+    return finished
+
+## Cap the threads of every math library in the worker processes started inside this block. Spawned workers
+## read these variables when they start, so each one uses threads_per_process threads and the pool as a whole
+## uses about one thread per core.
+@contextmanager
+def limited_threads(threads_per_process):
+    saved = {name: os.environ.get(name) for name in THREAD_LIMITS}
+    os.environ.update({name: str(threads_per_process) for name in THREAD_LIMITS})
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+## Yield the rows of each run, as a list, as soon as the run finishes (in completion order).
+##   collection: the models' collection policy ("step", k, "generation" or "final"), passed to every run without
+##               becoming a parameter column; data_collection_period then picks among the recorded steps
+##   columnar: yield each run as a dict of column arrays instead
+##   processes: worker processes (default: one per core); 1 runs everything in this process
+##   chunksize: runs handed to a worker at a time (default: about four chunks per worker)
+##   seed: base of the per-run seeds
+##   journal: file to record finished runs in and to resume from
+##   cache: a RunCache, or the path of its folder, to fetch finished runs from and store new ones in
+##   threads_per_process: BLAS / OpenMP threads each worker may use
+def iter_sweep(model_cls, parameters, iterations=1, max_steps=1000, data_collection_period=-1,
+               processes=None, chunksize=None, seed=0, journal=None, cache=None, display_progress=True,
+               threads_per_process=1, collection=None, columnar=False):
+    output = (lambda columns: columns) if columnar else run_rows
+    runs = make_runs(model_cls, parameters, iterations, seed)
+    finished = read_journal(journal) if journal is not None else {}
+    if isinstance(cache, (str, os.PathLike)):
+        cache = RunCache(cache)
+    cache_keys = {}
+    tasks = []
+    with tqdm(total=len(runs), disable=not display_progress) as progress:
+        for run_id, iteration, kwargs in runs:
+            key = run_key(model_cls, iteration, kwargs, max_steps, data_collection_period, collection)
+            records = None
+            if cache is not None:
+                cached_kwargs = kwargs if collection is None else {**kwargs, "collection": collection}
+                cache_keys[run_id] = cache.key(model_cls, cached_kwargs, max_steps, data_collection_period)
+                records = cache.get(cache_keys[run_id])
+            if key in finished:
+                progress.update()
+                yield output({**{name: np.asarray(values) for name, values in finished[key].items()},
+                              "RunId": np.full(len(finished[key]["Step"]), run_id)})
+            elif records is not None:
+                progress.update()
+                yield output(run_columns(run_id, iteration, kwargs, records))
+            else:
+                tasks.append((model_cls, run_id, iteration, kwargs, max_steps, data_collection_period, collection))
+        keys = {task[1]: run_key(model_cls, task[2], task[3], max_steps, data_collection_period, collection)
+                for task in tasks}
+        tasks_by_id = {task[1]: task for task in tasks}
+        processes = min(processes or os.cpu_count() or 1, max(len(tasks), 1))
+        log = open(journal, "a") if journal is not None else None
+        pool = None
+        try:
+            if processes == 1:
+                results = map(run_model, tasks)
+            else:
+                chunksize = chunksize or max(1, len(tasks) // (4 * processes))
+                with limited_threads(threads_per_process):
+                    pool = multiprocessing.Pool(processes)
+                results = pool.imap_unordered(run_model, tasks, chunksize)
+            for run_id, columns in results:
+                if cache is not None:
+                    ## Keep only what the run computed: the step and the reporter values
+                    cache.put(cache_keys[run_id], {name: values.tolist() for name, values in columns.items()
+                                                   if name not in ("RunId", "iteration", *tasks_by_id[run_id][3])})
+                if log is not None:
+                    log.write(json.dumps({"key": keys[run_id], "columns": {name: values.tolist()
+                                                                           for name, values in columns.items()}},
+                                         default=plain) + "\n")
+                    log.flush()
+                progress.update()
+                yield output(columns)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            if log is not None:
+                log.close()
+
+## Run a whole sweep and return all rows in RunId order, like batch_run
+def sweep(model_cls, parameters, iterations=1, max_steps=1000, data_collection_period=-1, **options):
+    rows = [row for run in iter_sweep(model_cls, parameters, iterations, max_steps, data_collection_period, **options)
+            for row in run]
+    return sorted(rows, key=lambda row: row["RunId"])
+
+## Run a whole sweep and return a DataFrame in RunId order, with the same columns as pd.DataFrame(sweep(...)),
+## built by joining the runs' column arrays (no row dicts in between)
+def sweep_frame(model_cls, parameters, iterations=1, max_steps=1000, data_collection_period=-1, **options):
+    runs = sorted(iter_sweep(model_cls, parameters, iterations, max_steps, data_collection_period, columnar=True,
+                             **options), key=lambda columns: columns["RunId"][0])
+    if not runs:
+        return pd.DataFrame()
+    return pd.DataFrame({name: np.concatenate([columns[name] for columns in runs]) for name in runs[0]}, copy=False)
@@ -0,0 +1,100 @@
+import os
+import json
+import shutil
+from itertools import chain, islice
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow.fs import LocalFileSystem
+from sweep import iter_sweep
+
+## Sweep results on disk as an Arrow dataset, for sweeps too large to hold as rows or one DataFrame:
+##   * runs are written as they finish, in Parquet or Arrow IPC files, one folder per value of each
+##     partitioning parameter (key_change=0.25/horizontal_ratio=0.5/...);
+##   * reading back opens the files memory-mapped and only loads the columns and partitions asked for.
+
+## The dataset's schema, with the file format and the partitioning parameters in its metadata
+SCHEMA_FILE = "_schema.arrow"
+## Number of finished runs the column types are taken from before writing starts
+SCHEMA_RUNS = 16
+
+def write_schema(path, schema):
+    with open(os.path.join(path, SCHEMA_FILE), "wb") as file:
+        file.write(schema.serialize())
+
+def read_schema(path):
+    with open(os.path.join(path, SCHEMA_FILE), "rb") as file:
+        return pa.ipc.read_schema(pa.py_buffer(file.read()))
+
+## Column types shared by all the given runs: integers that are fractions in some run become floats, and
+## columns that are empty (only None) in every run take their type from types, or else become strings
+def common_schema(batches, types):
+    schema = pa.unify_schemas([batch.schema for batch in batches], promote_options="permissive")
+    for i, field in enumerate(schema):
+        if field.name in types:
+            schema = schema.set(i, field.with_type(pa.type_for_alias(types[field.name])))
+        elif pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+    return schema
+
+## Run a sweep like sweep.sweep and write its rows into a dataset at path, run by run as the runs finish.
+##   format: "parquet" or "ipc" (Arrow IPC files, which are read back without decoding)
+##   partition_by: parameters to make folders for (default: every parameter given more than one value)
+##   rows_per_group: most rows in one Parquet row group / IPC record batch. Each run's rows are written
+##                   as soon as the run finishes, so runs are never held back to fill a group.
+##   types: Arrow types (e.g. {"convergence_step": "int64"}) of columns that may be None in the first runs
+##   overwrite: replace an existing dataset at path
+## The remaining options are those of iter_sweep.
+def sweep_to_dataset(model_cls, parameters, path, iterations=1, max_steps=1000, data_collection_period=-1,
+                     format="parquet", partition_by=None, rows_per_group=65536, types=None, overwrite=False,
+                     **options):
+    if format not in ("parquet", "ipc"):
+        raise ValueError(f"Unknown format {format!r}, must be 'parquet' or 'ipc'")
+    if os.path.isdir(path) and os.listdir(path):
+        if not overwrite:
+            raise FileExistsError(f"{path} already holds a dataset, pass overwrite=True to replace it")
+        shutil.rmtree(path)
+    os.makedirs(path, exist_ok=True)
+    if partition_by is None:
+        partition_by = [name for name, values in parameters.items()
+                        if not isinstance(values, str) and hasattr(values, "__len__") and len(values) > 1]
+    runs = iter_sweep(model_cls, parameters, iterations, max_steps, data_collection_period, columnar=True, **options)
+    batches = (pa.RecordBatch.from_pydict(columns) for columns in runs)
+    first = list(islice(batches, SCHEMA_RUNS))
+    if not first:
+        return
+    schema = common_schema(first, types or {})
+    schema = schema.with_metadata({"format": format, "partitioning": json.dumps(partition_by)})
+    write_schema(path, schema)
+    ds.write_dataset(
+        (batch.cast(schema) for batch in chain(first, batches)), path, schema=schema, format=format,
+        partitioning=ds.partitioning(pa.schema([schema.field(name) for name in partition_by]), flavor="hive"),
+        basename_template="part-{i}." + ("parquet" if format == "parquet" else "arrow"),
+        max_rows_per_group=rows_per_group,
+        existing_data_behavior="overwrite_or_ignore")
+
+## The dataset at path as a pyarrow Dataset. Nothing is read until it is scanned, and files are memory-mapped.
+def open_sweep(path):
+    schema = read_schema(path)
+    partition_by = json.loads(schema.metadata[b"partitioning"])
+    return ds.dataset(path, schema=schema, format=schema.metadata[b"format"].decode(),
+                      partitioning=ds.partitioning(pa.schema([schema.field(name) for name in partition_by]), flavor="hive"),
+                      filesystem=LocalFileSystem(use_mmap=True))
+
+## Filter expression for where: a pyarrow expression, or a dict of column -> value or list of values
+def where_expression(where):
+    if where is None or isinstance(where, ds.Expression):
+        return where
+    expression = None
+    for name, value in where.items():
+        if isinstance(value, (list, tuple, set, np.ndarray)):
+            condition = ds.field(name).isin(np.asarray(list(value)).tolist())
+        else:
+            condition = ds.field(name) == (value.item() if hasattr(value, "item") else value)
+        expression = condition if expression is None else expression & condition
+    return expression
+
+## Load the given columns of the rows matching where as a DataFrame. Filters on partitioning parameters
+## skip whole folders, and only the requested columns are read from the files.
+def load_sweep(path, columns=None, where=None):
+    return open_sweep(path).to_table(columns=columns, filter=where_expression(where)).to_pandas()